@@ -0,0 +1,277 @@
+"""Timings of the analytics functions over the committed data and synthetic 20 team leagues.
+
+Every case's median time is compared with the baseline in
+benchmarks/baselines/analytics_suite.json. A case counts as a regression when it is both
+more than threshold slower and more than min_delta seconds slower. min_delta is kept below
+the smallest baselines, so it only screens out jitter and a doubling of any case still fails.
+Cases that look slower are timed a second time and the run only fails if they are still
+slower, so an unchanged tree passes even on a noisy machine. Baselines depend on the machine,
+so save new ones when the benchmarks move to a different machine.
+
+Run from the repo root:
+    python -m benchmarks.analytics_suite                 # compare with the baseline
+    python -m benchmarks.analytics_suite --save          # write a new baseline
+    python -m benchmarks.analytics_suite --only luck     # cases whose name contains "luck"
+"""
+
+import argparse
+import glob
+import json
+import os
+import pickle
+import platform
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from espn_data.build_tables import (
+    add_ideal_to_player_df,
+    create_top6_and_record_table,
+    waiver_table,
+    win_loss_marings,
+)
+from espn_data.counterfactuals import slot_counterfactuals
+from espn_data.ff_probability import build_probability_distribution
+from espn_data.schedules import all_play_table, schedule_swap_table
+from espn_data.schema import complete_weeks, load_season
+from espn_data.transactions import activity_rows, read_transactions, transactions_frame
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baselines", "analytics_suite.json")
+PLAYER_COLUMNS = {
+    "owner": "team_name",
+    "player_position": "player_pos",
+    "slot_position": "player_slot",
+    "points": "player_points",
+    "projected_points": "player_proj_points",
+}
+# Starting slots then bench spots of a synthetic roster
+ROSTER = [
+    ("QB", "QB"),
+    ("RB", "RB"),
+    ("RB", "RB"),
+    ("WR", "WR"),
+    ("WR", "WR"),
+    ("TE", "TE"),
+    ("RB", "RB/WR/TE"),
+    ("D/ST", "D/ST"),
+    ("QB", "BE"),
+    ("RB", "BE"),
+    ("RB", "BE"),
+    ("WR", "BE"),
+    ("WR", "BE"),
+    ("TE", "BE"),
+    ("WR", "BE"),
+    ("D/ST", "BE"),
+]
+
+
+def synthetic_season(year, n_teams=20, n_weeks=14, seed=0):
+    """A fantasy_data style season of random head to head matchups"""
+    rng = np.random.default_rng([seed, year])
+    teams = np.array([f"Team {team:02d}" for team in range(n_teams)])
+    weeks = []
+    for week in range(1, n_weeks + 1):
+        order = rng.permutation(n_teams)
+        opponents = np.empty(n_teams, dtype=int)
+        opponents[order[0::2]], opponents[order[1::2]] = order[1::2], order[0::2]
+        points = rng.normal(110, 25, n_teams).round(2)
+        rank = (-points).argsort().argsort() + 1
+        weeks.append(
+            pd.DataFrame(
+                {
+                    "team_name": teams,
+                    "week": week,
+                    "points": points,
+                    "opponent": teams[opponents],
+                    "h2h_win": points > points[opponents],
+                    "points_against": points[opponents],
+                    "top6_win": rank <= 6,
+                    "year": year,
+                }
+            )
+        )
+    return pd.concat(weeks, ignore_index=True)
+
+
+def synthetic_players(years, n_teams=20, n_weeks=14, seed=0):
+    """A build_full_player_df style table for every team-week of several seasons"""
+    rng = np.random.default_rng(seed)
+    keys = pd.MultiIndex.from_product(
+        [years, range(1, n_weeks + 1), [f"Team {team:02d}" for team in range(n_teams)]],
+        names=["year", "week", "team_name"],
+    ).to_frame(index=False)
+    players = keys.loc[keys.index.repeat(len(ROSTER))].reset_index(drop=True)
+    positions, slots = zip(*ROSTER)
+    players["player_pos"] = np.tile(positions, len(keys))
+    players["player_slot"] = np.tile(slots, len(keys))
+    players["player_points"] = rng.gamma(2, 5, len(players)).round(2)
+    # Team 00 plays Team 01, Team 02 plays Team 03 and so on every week
+    team_numbers = players["team_name"].str[-2:].astype(int)
+    players["opponent"] = "Team " + (team_numbers ^ 1).astype(str).str.zfill(2)
+    return players
+
+
+def archived_players():
+    """Every archived season's player table with build_full_player_df column names"""
+    paths = sorted(glob.glob("fantasy/full_player_data/player_data_*.csv"))
+    players = pd.concat([pd.read_csv(path) for path in paths], ignore_index=True)
+    return players.rename(columns=PLAYER_COLUMNS)
+
+
+def pickled_transactions(path="wd_2024.pickle"):
+    with open(path, "rb") as handle:
+        return transactions_frame(activity_rows(pickle.load(handle)))
+
+
+def load_pickle(path):
+    with open(path, "rb") as handle:
+        return pickle.load(handle)
+
+
+def build_cases():
+    """{name: function} for every benchmark, with the input data already loaded"""
+    season_2020 = pd.read_csv("fantasy/fantasy_data_2020.csv")
+    seasons = {
+        year: pd.read_csv(path)
+        for year, path in (
+            (int(path[-8:-4]), path) for path in sorted(glob.glob("fantasy/fantasy_data_*.csv"))
+        )
+    }
+    synthetic = [synthetic_season(year) for year in range(2010, 2022)]
+    all_synthetic = pd.concat(synthetic, ignore_index=True)
+    all_seasons = pd.concat(
+        [complete_weeks(load_season(s)).team_weeks for s in seasons.values()], ignore_index=True
+    )
+    players = archived_players()
+    history = pd.read_csv("fantasy/full_player_data/merged_full_data.csv")
+    big_players = synthetic_players(list(range(2010, 2022)))
+    transactions = pickled_transactions()
+    return {
+        # Committed data at its real size
+        "records/2020": lambda: create_top6_and_record_table(season_2020),
+        "records/all_seasons": lambda: [create_top6_and_record_table(s) for s in seasons.values()],
+        "luck_vectorized/2020": lambda: build_probability_distribution(season_2020, seed=1),
+        "luck_exact/2020": lambda: build_probability_distribution(season_2020, method="exact"),
+        "margins/2020": lambda: win_loss_marings(season_2020),
+        "waiver_table/2024": lambda: waiver_table(None, transactions),
+        "ideal_lineups/archived": lambda: add_ideal_to_player_df(
+            players, group_cols=("year", "week", "team_name")
+        ),
+        "slot_counterfactuals/archived": lambda: slot_counterfactuals(history),
+        "schedule_swap/all_seasons": lambda: schedule_swap_table(all_seasons),
+        "all_play/all_seasons": lambda: all_play_table(all_seasons),
+        "load/fantasy_data_csv": lambda: [
+            pd.read_csv(path) for path in sorted(glob.glob("fantasy/fantasy_data_*.csv"))
+        ],
+        "load/season_model": lambda: [load_season(s) for s in seasons.values()],
+        "load/player_data_csv": lambda: pd.read_csv(
+            "fantasy/full_player_data/merged_full_data.csv"
+        ),
+        "load/fantasy_dst_csv": lambda: pd.read_csv("fantasy_dst.csv"),
+        "load/wd_pickle_2024": lambda: load_pickle("wd_2024.pickle"),
+        "load/wd_parquet_2024": lambda: read_transactions("wd_2024"),
+        # Synthetic 20 team leagues over 12 seasons
+        "records/synthetic_20x12": lambda: [create_top6_and_record_table(s) for s in synthetic],
+        "luck_vectorized/synthetic_20x12": lambda: [
+            build_probability_distribution(s, seed=1) for s in synthetic
+        ],
+        "luck_exact/synthetic_20x12": lambda: [
+            build_probability_distribution(s, method="exact") for s in synthetic
+        ],
+        "margins/synthetic_20x12": lambda: [win_loss_marings(s) for s in synthetic],
+        "ideal_lineups/synthetic_20x12": lambda: add_ideal_to_player_df(
+            big_players, group_cols=("year", "week", "team_name")
+        ),
+        "schedule_swap/synthetic_20x12": lambda: schedule_swap_table(all_synthetic),
+        "all_play/synthetic_20x12": lambda: all_play_table(all_synthetic),
+        "slot_counterfactuals/synthetic_20x12": lambda: slot_counterfactuals(
+            big_players, team_col="team_name", slot_col="player_slot", points_col="player_points"
+        ),
+    }
+
+
+def time_case(function, repeat=9, min_sample=0.05):
+    """Median seconds per call, looping fast functions so each sample takes min_sample
+
+    The median of several samples moves much less between runs than any single sample.
+    """
+    start = time.perf_counter()
+    function()
+    number = max(1, int(min_sample / max(time.perf_counter() - start, 1e-6)))
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        samples.append((time.perf_counter() - start) / number)
+    return float(np.median(samples))
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def regressions(results, baseline, threshold, min_delta):
+    """Cases slower than baseline by more than threshold, ignoring changes under min_delta"""
+    slower = {}
+    for name, seconds in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if seconds > before * (1 + threshold) and seconds - before > min_delta:
+            slower[name] = (before, seconds)
+    return slower
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--save", action="store_true", help="Write the results as the baseline")
+    parser.add_argument("--only", default="", help="Only run cases containing this text")
+    parser.add_argument("--repeat", type=int, default=9)
+    parser.add_argument("--threshold", type=float, default=1.0, help="Allowed slowdown, 1.0 = 2x")
+    parser.add_argument("--min-delta", type=float, default=0.002, help="Ignore changes below, s")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as handle:
+            baseline = json.load(handle)["seconds"]
+
+    cases = {name: function for name, function in build_cases().items() if args.only in name}
+    results = {}
+    for name, function in cases.items():
+        results[name] = time_case(function, repeat=args.repeat)
+        before = baseline.get(name)
+        change = f"{results[name] / before - 1:+.0%}" if before else "new"
+        print(f"{name:>34}: {results[name] * 1000:9.2f} ms  {change}")
+
+    if args.save:
+        os.makedirs(os.path.dirname(BASELINE_PATH), exist_ok=True)
+        with open(BASELINE_PATH, "w") as handle:
+            json.dump(
+                {"environment": environment(), "seconds": dict(baseline, **results)},
+                handle,
+                indent=2,
+                sort_keys=True,
+            )
+        print(f"Saved {BASELINE_PATH}")
+        sys.exit(0)
+
+    # Time the cases that look slower again, one slow stretch of the machine is not a regression
+    slower = regressions(results, baseline, args.threshold, args.min_delta)
+    for name in slower:
+        retimed = time_case(cases[name], repeat=args.repeat)
+        print(f"{name:>34}: {retimed * 1000:9.2f} ms  timed again")
+        results[name] = min(results[name], retimed)
+    slower = regressions(results, baseline, args.threshold, args.min_delta)
+    for name, (before, seconds) in slower.items():
+        print(f"REGRESSION {name}: {before * 1000:.2f} ms -> {seconds * 1000:.2f} ms")
+    sys.exit(1 if slower else 0)
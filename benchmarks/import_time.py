@@ -0,0 +1,62 @@
+"""Cold start import time of the Cloud Function entry point and the dashboard.
+
+Every sample imports in a fresh interpreter, as a cold start does. The app is a Streamlit
+script, so only its import statements are timed, not the page itself.
+
+Run from the repo root: python -m benchmarks.import_time [--repeat 7]
+"""
+
+import argparse
+import ast
+import json
+import statistics
+import subprocess
+import sys
+
+# Modules that ingestion and analytics should not need
+HEAVY_MODULES = ["streamlit", "altair", "google.cloud.storage", "gcsfs", "toolz"]
+
+
+def app_imports(path="fantasy_app.py"):
+    """The top level import statements of a script, as source"""
+    with open(path) as handle:
+        tree = ast.parse(handle.read())
+    imports = [node for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+    return "\n".join(ast.unparse(node) for node in imports)
+
+
+TARGETS = {
+    "cloud function (main)": "import main",
+    "analytics": "import espn_data.analytics",
+    "app imports": app_imports(),
+}
+
+
+def time_import(source):
+    """Seconds to run source in a fresh interpreter and the heavy modules it loaded"""
+    script = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        f"exec(compile({source!r}, '<imports>', 'exec'))\n"
+        "elapsed = time.perf_counter() - start\n"
+        f"heavy = [name for name in {HEAVY_MODULES!r} if name in sys.modules]\n"
+        "print(json.dumps({'seconds': elapsed, 'heavy': heavy}))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=7)
+    args = parser.parse_args()
+
+    for label, source in TARGETS.items():
+        samples = [time_import(source) for _ in range(args.repeat)]
+        seconds = [sample["seconds"] for sample in samples]
+        print(
+            f"{label:>22}: median {statistics.median(seconds) * 1000:.0f} ms, "
+            f"min {min(seconds) * 1000:.0f} ms, loads {', '.join(samples[0]['heavy']) or 'none'}"
+        )
@@ -0,0 +1,50 @@
+"""Wall time and peak memory of building a season's player table, offline.
+
+Run from the repo root: python -m benchmarks.player_ingestion
+"""
+
+import time
+import tracemalloc
+
+import pandas as pd
+
+from espn_data.build_tables import build_full_player_df, player_df_from_line
+from espn_data.fake_league import FakeLeague
+from espn_data.get_espn_data import box_score_cache, completed_weeks
+
+
+def per_lineup_player_df(league):
+    """The previous path: one small sorted DataFrame per lineup, concatenated at the end"""
+    full_player_df = []
+    for week in completed_weeks(league):
+        for match in box_score_cache.get(league, week):
+            full_player_df.append(player_df_from_line(match.home_lineup, match, week, True))
+            full_player_df.append(player_df_from_line(match.away_lineup, match, week, False))
+    return pd.concat(full_player_df)
+
+
+def measure(build, league):
+    """Wall time, peak traced memory and result size of build(league)"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    player_df = build(league)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, player_df.memory_usage(deep=True).sum(), len(player_df)
+
+
+if __name__ == "__main__":
+    league = FakeLeague.from_player_data("fantasy/full_player_data/player_data_2021.csv")
+    for week in completed_weeks(league):
+        box_score_cache.get(league, week)
+
+    for label, build in [
+        ("per lineup frames", per_lineup_player_df),
+        ("columnar", build_full_player_df),
+    ]:
+        elapsed, peak, size, rows = measure(build, league)
+        print(
+            f"{label:>18}: {rows} rows, {elapsed * 1000:.0f} ms, "
+            f"peak {peak / 1e6:.1f} MB, frame {size / 1e6:.2f} MB"
+        )
@@ -1,8 +1,7 @@
-import pandas as pd
 from espn_data.get_espn_data import get_season_data
 from espn_api.football import League
 import toml
-import pickle
+from espn_data.transactions import sync_transactions
 
 YEAR = 2025
 secrets = toml.load(".streamlit/secrets.toml")
@@ -13,10 +12,7 @@ all_data = get_season_data(YEAR, league)
 
 all_data.to_csv(f"./fantasy/fantasy_data_{YEAR}.csv", index=False)
 
-# Download the waiver data
-ra = league.recent_activity(2000)
-print(len(ra))
-filename = f"./wd_{YEAR}.pickle"
-with open(filename, "wb") as handle:
-    pickle.dump(ra, handle, protocol=pickle.HIGHEST_PROTOCOL)
+# Append the waiver data since the last download
+new_transactions = sync_transactions(league, f"./wd_{YEAR}")
+print(new_transactions)
 # logging.info("Waiver data saved")
@@ -1,3 +1,11 @@
-from . import get_espn_data
-from . import ff_probability
-from . import build_tables
+import importlib
+
+# Submodules are imported on first use so that importing one of them, e.g. from the Cloud
+# Function, does not pull in the others
+__all__ = ["get_espn_data", "ff_probability", "build_tables"]
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,107 @@
+import io
+import json
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from .build_tables import calc_margins_waivers, create_top6_and_record_table
+from .ff_probability import build_probability_distribution, cumulative_table
+from .gcs_cache import blob_cache
+from .schedules import all_play_table, schedule_swap_table
+from .schema import complete_weeks, load_season
+from .tracing import traced
+
+# Bump when the tables change shape so the dashboard ignores artifacts it cannot read
+ANALYTICS_VERSION = 1
+ANALYTICS_PREFIX = "analytics"
+
+
+def has_complete_weeks(fantasy_data):
+    """Whether every team has played at least one week, build_analytics needs one"""
+    return len(fantasy_data) > 0 and not complete_weeks(load_season(fantasy_data)).team_weeks.empty
+
+
+@traced()
+def build_analytics(fantasy_data, league, transactions=None, seed=None):
+    """Compute every table the dashboard shows for a season
+
+    Only weeks that every team has played are used. The margins table needs the league for
+    box scores and reads the transactions from GCS unless a transaction table is passed in.
+    """
+    team_weeks = complete_weeks(load_season(fantasy_data)).team_weeks
+    records, t6_pivot = create_top6_and_record_table(team_weeks)
+    return {
+        "records": records,
+        "top6_pivot": t6_pivot.data,
+        "luck": cumulative_table(build_probability_distribution(team_weeks, seed=seed)),
+        "margins_waivers": calc_margins_waivers(team_weeks, league, transactions),
+        "schedule_swap": schedule_swap_table(team_weeks),
+        "all_play": all_play_table(team_weeks),
+    }
+
+
+def frame_to_parquet(df):
+    # Parquet needs string column names, the top 6 pivot has one column per week number
+    df = df.set_axis([str(col) for col in df.columns], axis=1)
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, engine="pyarrow")
+    return buffer.getvalue()
+
+
+def frame_from_parquet(data):
+    df = pd.read_parquet(io.BytesIO(data), engine="pyarrow")
+    return df.set_axis([int(col) if col.isdigit() else col for col in df.columns], axis=1)
+
+
+@traced()
+def write_analytics(analytics, gateway, year, week):
+    """Store the tables under analytics/{year}/week_{week}/ and point latest.json at them
+
+    The manifest is written last, so readers never see a partly written set of tables.
+    """
+    folder = f"{ANALYTICS_PREFIX}/{year}/week_{week:02d}"
+    manifest = {
+        "version": ANALYTICS_VERSION,
+        "year": int(year),
+        "week": int(week),
+        "built_at": datetime.now(timezone.utc).isoformat(),
+        "tables": {name: f"{folder}/{name}.parquet" for name in analytics},
+    }
+    gateway.upload_many(
+        {manifest["tables"][name]: frame_to_parquet(df) for name, df in analytics.items()},
+        content_type="application/octet-stream",
+    )
+    gateway.write_bytes(
+        f"{ANALYTICS_PREFIX}/{year}/latest.json", json.dumps(manifest), "application/json"
+    )
+    return manifest
+
+
+def load_manifest(gateway, year):
+    """The manifest of a season's latest tables, None if there are none for this version"""
+    manifest = blob_cache.get(gateway, f"{ANALYTICS_PREFIX}/{year}/latest.json", parse=json.loads)
+    if manifest is None or manifest.get("version") != ANALYTICS_VERSION:
+        return None
+    return manifest
+
+
+@traced()
+def load_table(gateway, manifest, name):
+    """One stored table of a manifest, None if it is missing or older than the table"""
+    if name not in manifest["tables"]:
+        return None
+    return blob_cache.get(gateway, manifest["tables"][name], parse=frame_from_parquet)
+
+
+def load_analytics(gateway, year):
+    """The latest stored tables for a season with their manifest, None if there are none
+
+    Artifacts written by another ANALYTICS_VERSION count as missing.
+    """
+    manifest = load_manifest(gateway, year)
+    if manifest is None:
+        return None
+    analytics = {name: load_table(gateway, manifest, name) for name in manifest["tables"]}
+    if any(df is None for df in analytics.values()):
+        return None
+    return analytics, manifest
@@ -1,12 +1,16 @@
 import pandas as pd
-from .get_espn_data import weeks_since_start_season
+import numpy as np
+from .get_espn_data import weeks_since_start_season, box_score_cache, completed_weeks
+from .gcs_cache import blob_cache
+from .lineups import mark_optimal_lineups
+from .schema import team_week_table
+from .storage_gateway import get_gateway, streamlit_credentials_info
+from .tracing import traced
+from .transactions import owner_name, activity_rows, read_transactions, transactions_frame
 from datetime import datetime
-import streamlit as st
-import altair as alt
 import pickle
-import json
-from google.cloud import storage
-from google.oauth2 import service_account
+import io
+from concurrent.futures import ThreadPoolExecutor
 
 
 # Style the table
@@ -32,24 +36,24 @@ def format_2_dec(x):
     return {col: "{:,.2}".format for col in x.columns}
 
 
+@traced()
 def create_top6_and_record_table(fantasy_data):
-    """Build the scoreboard starting from raw fantasy data"""
+    """Build the scoreboard from the team-week table (or raw fantasy data)"""
+
+    # Make a single table
+    fantasy_points = team_week_table(fantasy_data)
 
     # Top points per week
-    top_scorers = fantasy_data.iloc[
-        fantasy_data.reset_index().groupby(["week"])["points"].idxmax(), :
+    top_scorers = fantasy_points.iloc[
+        fantasy_points.reset_index().groupby(["week"])["points"].idxmax(), :
     ]
-    summed_tops = top_scorers.groupby("team_name").count()["week"]
+    summed_tops = top_scorers.groupby("team_name", observed=True).count()["week"]
     summed_tops = summed_tops.rename("top_scorer_sum")
 
-    # Make a single table
-    cols_remove = ["name", "tp_names", "tp_points"]
-    fantasy_points = fantasy_data.drop(columns=cols_remove).drop_duplicates()
-
     # Scoreboard Table
     summary_table_agg = (
         fantasy_points[["team_name", "points", "points_against", "h2h_win", "top6_win"]]
-        .groupby("team_name", group_keys=False)
+        .groupby("team_name", group_keys=False, observed=True)
         .agg("sum")
         .round(2)
     )
@@ -75,7 +79,7 @@ def create_top6_and_record_table(fantasy_data):
     # Add the times top scorer
     top_scorer_final = sub_owners.merge(
         top_scorer_final, how="left", left_index=True, right_index=True
-    ).fillna(0)
+    ).fillna({"top_scorer_sum": 0})
     top_scorer_final["top_scorer_sum"] = top_scorer_final["top_scorer_sum"].astype("int")
     top_scorer_final.rename(
         columns={
@@ -86,14 +90,16 @@ def create_top6_and_record_table(fantasy_data):
         inplace=True,
     )
     # Top 6 table
-    t6_pivot = (
-        fantasy_points.pivot(index="team_name", columns="week", values="points")
-        .loc[top_scorer_final.index]
-        .style.apply(highlight_true)
-        .format("{:.5}")
-    )
+    t6_pivot = fantasy_points.pivot(index="team_name", columns="week", values="points").loc[
+        top_scorer_final.index
+    ]
 
-    return top_scorer_final, t6_pivot
+    return top_scorer_final, style_top6_pivot(t6_pivot)
+
+
+def style_top6_pivot(t6_pivot):
+    """Color each week's scores in the team by week points pivot"""
+    return t6_pivot.style.apply(highlight_true).format("{:.5}")
 
 
 def player_df_from_line(lineup, first_matchup, week, home_team):
@@ -168,32 +174,12 @@ def position_sorter(column):
     return column.map(correspondence)
 
 
-def add_ideal_to_player_df(player_df):
+@traced()
+def add_ideal_to_player_df(player_df, group_cols=("team_name",)):
     """Add a tag to the player to determine if they were an ideal pick for that week"""
-    positions = ["QB", "RB1", "RB2", "WR1", "WR2", "TE", "FLEX", "D/ST"]
-    ordered_played = player_df.iterrows()
-
-    found_positions = []
-    for i, pos in ordered_played:
-        for set_pos in positions:
-            if pos.player_pos in set_pos:
-                found_positions.append(pos)
-                positions.remove(set_pos)
-                break
-            elif set_pos == "FLEX" and pos.player_pos in ["WR", "RB", "TE"]:
-                found_positions.append(pos)
-                positions.remove(set_pos)
-                break
-
-    ideal_lineup = (
-        pd.concat(found_positions, axis=1)
-        .transpose()
-        .sort_values(by="player_pos", key=position_sorter)
-    )
-    ideal_lineup["ideal_player"] = True
-    comb_player_ideal = player_df.merge(
-        ideal_lineup[["team_name", "player_name", "ideal_player"]], how="left"
-    ).fillna(False)
+    comb_player_ideal = mark_optimal_lineups(
+        player_df, group_cols=group_cols, pos_col="player_pos", points_col="player_points"
+    ).drop(columns="ideal_slot")
     comb_player_ideal["played"] = comb_player_ideal.player_slot != "BE"
     return comb_player_ideal
 
@@ -207,109 +193,186 @@ def build_matchup_player_dfs(matchup, week):
     home_player_df = player_df_from_line(home_lineup, matchup, week, True)
     away_player_df = player_df_from_line(away_lineup, matchup, week, False)
 
-    home_player_added_ideals = add_ideal_to_player_df(home_player_df)
-    away_player_added_ideals = add_ideal_to_player_df(away_player_df)
-
-    combined_set = pd.concat([home_player_added_ideals, away_player_added_ideals])
-    return combined_set
+    combined_set = pd.concat([home_player_df, away_player_df])
+    return add_ideal_to_player_df(combined_set)
+
+
+PLAYER_DF_COLS = [
+    "team_name",
+    "week",
+    "player_name",
+    "player_pos",
+    "player_slot",
+    "player_proj_points",
+    "player_points",
+    "opponent",
+]
+
+
+def player_columns_from_matchups(week_matchups):
+    """Stream every lineup of every week into preallocated column arrays"""
+    week_matchups = list(week_matchups)
+    n_players = sum(
+        len(match.home_lineup) + len(match.away_lineup)
+        for _, matchups in week_matchups
+        for match in matchups
+    )
+    columns = {
+        "team_name": np.empty(n_players, dtype=object),
+        "week": np.empty(n_players, dtype=np.int16),
+        "player_name": np.empty(n_players, dtype=object),
+        "player_pos": np.empty(n_players, dtype=object),
+        "player_slot": np.empty(n_players, dtype=object),
+        "player_proj_points": np.empty(n_players, dtype=np.float32),
+        "player_points": np.empty(n_players, dtype=np.float32),
+        "opponent": np.empty(n_players, dtype=object),
+    }
+
+    row = 0
+    for week, matchups in week_matchups:
+        for match in matchups:
+            home_name = owner_name(match.home_team)
+            away_name = owner_name(match.away_team)
+            for lineup, team_name, opponent in [
+                (match.home_lineup, home_name, away_name),
+                (match.away_lineup, away_name, home_name),
+            ]:
+                end = row + len(lineup)
+                columns["team_name"][row:end] = team_name
+                columns["week"][row:end] = week
+                columns["opponent"][row:end] = opponent
+                for i, player in enumerate(lineup, start=row):
+                    columns["player_name"][i] = player.name
+                    columns["player_pos"][i] = player.position
+                    columns["player_slot"][i] = player.slot_position
+                    columns["player_proj_points"][i] = player.projected_points
+                    columns["player_points"][i] = player.points
+                row = end
+    return columns
 
 
 ## Build the player DF
-def build_full_player_df(our_league):
-    """Build a dataframe of teams and player information on each team"""
-    full_player_df = []
-    for week in range(1, 10 + 1):
-        matchups = our_league.box_scores(week)
-        for match in matchups:
-            full_player_df.append(build_matchup_player_dfs(match, week))
+@traced()
+def build_full_player_df(our_league, max_workers=1):
+    """Build a dataframe of teams and player information on each team
+
+    Covers every completed week of the season, with categorical names and float32 points.
+    """
+    weeks = completed_weeks(our_league)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        all_matchups = executor.map(lambda week: box_score_cache.get(our_league, week), weeks)
+        columns = player_columns_from_matchups(zip(weeks, all_matchups))
+
+    full_player_df = pd.DataFrame(columns)
+    for col in ["team_name", "player_name", "player_pos", "player_slot", "opponent"]:
+        full_player_df[col] = full_player_df[col].astype("category")
+
+    # Mark the ideal lineups for every team and week in one pass
+    return add_ideal_to_player_df(full_player_df, group_cols=("week", "team_name"))
+
+
+@traced()
+def get_waiver_data(
+    year, columns=None, actions=None, bucket_name="fantasy-football-palo-alto-data"
+):
+    """Get the transaction table from GCP, optionally only some columns and actions"""
+    gateway = get_gateway(bucket_name, credentials_info=streamlit_credentials_info)
+    parts = blob_cache.get_prefix(
+        gateway,
+        f"wd_{year}/",
+        parse=lambda data: read_transactions(io.BytesIO(data), columns=columns, actions=actions),
+        variant=f"{columns}{actions}",
+    )
+    if parts:
+        return pd.concat(parts, ignore_index=True)
+
+    # Seasons that have not been converted yet are still pickled Activity objects
+    transactions = blob_cache.get(
+        gateway,
+        f"wd_{year}.pickle",
+        parse=lambda data: transactions_frame(activity_rows(pickle.loads(data))),
+    )
+    if actions is not None:
+        transactions = transactions[transactions.action.isin(actions)]
+    return transactions[list(columns)] if columns is not None else transactions
 
-    return pd.concat(full_player_df)
 
+@traced()
+def waiver_table(league, transactions=None):
+    """Create a table of teams, transaction, and player_names
 
-@st.cache_data(ttl=50000)
-def get_waiver_data(year, bucket_name="fantasy-football-palo-alto-data"):
-    """Get the waiver dictionary from GCP"""
-    # Set GCP creds
-    gcp_json_credentials_dict = json.load(open("fantasy_profile.json", "r"))
-    gcp_json_credentials_dict.update(
+    Reads the season's transactions from GCS unless a transaction table is passed in.
+    """
+    if transactions is None:
+        fa_adds = get_waiver_data(
+            league.year,
+            columns=("date", "team_name", "action", "player_name"),
+            actions=("FA ADDED", "WAIVER ADDED"),
+        )
+    else:
+        fa_adds = transactions[transactions.action.isin(["FA ADDED", "WAIVER ADDED"])]
+    fa_adds = fa_adds.sort_values("date", ascending=False, kind="stable")
+    transaction_dates = [
+        datetime.fromtimestamp(date / 1000).strftime("%Y-%m-%d %H:%M:%S.%f")
+        for date in fa_adds.date
+    ]
+    return pd.DataFrame(
         {
-            "private_key": st.secrets["private_key"].replace("\\n", "\n"),
-            "private_key_id": st.secrets["private_key_id"],
+            "date": transaction_dates,
+            "team_name": fa_adds.team_name.astype(str).values,
+            "action": fa_adds.action.astype(str).values,
+            "player_name": fa_adds.player_name.astype(str).values,
         }
     )
-    credentials = service_account.Credentials.from_service_account_info(gcp_json_credentials_dict)
-    storage_client = storage.Client(credentials=credentials)
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(f"wd_{year}.pickle")
-    pickle_in = blob.download_as_string()
-    my_dictionary = pickle.loads(pickle_in)
-
-    return my_dictionary
-
-
-def waiver_table(league):
-    """Create a table of teams, transaction, and player_names"""
-    activities = get_waiver_data(league.year)
-    fa_adds = []
-    for activity in activities:
-        row = []
-        transaction_date = datetime.fromtimestamp(activity.date / 1000).strftime(
-            "%Y-%m-%d %H:%M:%S.%f"
-        )
-        for step in activity.actions:
-            if "FA ADDED" in step or "WAIVER ADDED" in step:
-                row.append(transaction_date)
-                row.append(step[0].owners[0]["firstName"] + " " + step[0].owners[0]["lastName"])
-                row.append(step[1])
-                row.append(step[2].name)
-                fa_adds.append(row)
-    return pd.DataFrame(fa_adds, columns=["date", "team_name", "action", "player_name"])
 
 
 # Average waiver points by team
-def calc_avg_waiver_points_by_team(our_league):
+@traced()
+def calc_avg_waiver_points_by_team(our_league, transactions=None):
     """Create a dataframe of team_name and average points for waiver addition"""
     full_player_table = build_full_player_df(our_league)
-    transaction_table = waiver_table(our_league)
+    transaction_table = waiver_table(our_league, transactions)
 
     full_player_df_waivers = full_player_table.merge(
         transaction_table[["team_name", "player_name", "action"]], how="left"
-    ).fillna("DRAFTED")
+    ).fillna({"action": "DRAFTED"})
     avg_waiver_points = (
         full_player_df_waivers[
             (full_player_df_waivers["action"].isin(["WAIVER ADDED", "FA ADDED"]))
             & (full_player_df_waivers["played"] == 1)
         ]
-        .groupby("team_name")
+        .groupby("team_name", observed=True)
         .agg(avg_player_points=("player_points", "mean"))
         .reset_index()
     )
     avg_waiver_points = avg_waiver_points.rename(
         columns={"avg_player_points": "average_waiver_points"}
-    ).fillna(0)
+    ).fillna({"average_waiver_points": 0})
     return avg_waiver_points
 
 
 # Calculate win vs loss point differential
+@traced()
 def win_loss_marings(ffdata):
     """Create a dataframe of team, avg win margin, and avg loss margin"""
-    ffdata["point_diff"] = ffdata.points - ffdata.points_against
-    win_loss_diff_table = ffdata.groupby(["team_name", "h2h_win"], as_index=False)[
+    ffdata = team_week_table(ffdata).assign(point_diff=lambda x: x.points - x.points_against)
+    win_loss_diff_table = ffdata.groupby(["team_name", "h2h_win"], as_index=False, observed=True)[
         "point_diff"
     ].mean()
     win_loss_pivot = win_loss_diff_table.pivot(
         index="team_name", columns="h2h_win", values="point_diff"
-    ).fillna(0)
+    )
     win_loss_pivot = win_loss_pivot.reset_index().rename_axis(None, axis=1)
     win_loss_pivot.columns = ["team_name", "avg_margin_of_loss", "avg_margin_of_victory"]
-    return win_loss_pivot
+    return win_loss_pivot.fillna({"avg_margin_of_loss": 0, "avg_margin_of_victory": 0})
 
 
 # Joined teams, margins, and waiver points
-def calc_margins_waivers(fantasy_data, our_league):
+@traced()
+def calc_margins_waivers(fantasy_data, our_league, transactions=None):
     """Create a dataframe of teams, avg_loss_margin, avg_waiver_points"""
     win_loss_pivot = win_loss_marings(fantasy_data)
-    avg_waiver_points = calc_avg_waiver_points_by_team(our_league)
+    avg_waiver_points = calc_avg_waiver_points_by_team(our_league, transactions)
     combined = win_loss_pivot.merge(avg_waiver_points, how="outer")
     for col in ["avg_margin_of_loss", "avg_margin_of_victory", "average_waiver_points"]:
         combined[col] = pd.to_numeric(combined[col])
@@ -318,6 +381,8 @@ def calc_margins_waivers(fantasy_data, our_league):
 
 def avg_margin_chart(margins_wavier_pts):
     """Make a chart for the average margin of victory or loss"""
+    import altair as alt
+
     loss_points = (
         alt.Chart(margins_wavier_pts)
         .mark_point(filled=True, size=50, color="tomato")
@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+
+from .lineups import BENCH_SLOTS
+from .tracing import traced
+
+SCENARIOS = {
+    "without_slot": "The team's own slot scores zero",
+    "without_both_slots": "The slot scores zero for both teams",
+    "swapped_slot": "The two teams trade the slot's points",
+}
+SUMMARY_COLS = ["matchups", "wins", "wins_lost_without_slot"] + [
+    f"flips_{scenario}" for scenario in SCENARIOS
+]
+
+
+def slot_matrix(player_df, group_cols, team_col, slot_col, points_col):
+    """Starter points as a (team-weeks, slots) array, with the team-week keys and slot names
+
+    Slots that appear more than once in a lineup, such as RB, are summed.
+    """
+    starters = player_df[~player_df[slot_col].isin(BENCH_SLOTS)]
+    keys = starters[group_cols + [team_col]]
+    team_week_codes, team_weeks = pd.MultiIndex.from_frame(keys.astype(object)).factorize()
+    team_weeks = team_weeks.set_names(keys.columns)
+    slot_codes, slots = pd.factorize(starters[slot_col].astype(object), sort=True)
+
+    matrix = np.bincount(
+        team_week_codes * len(slots) + slot_codes,
+        weights=starters[points_col].to_numpy(dtype=float),
+        minlength=len(team_weeks) * len(slots),
+    ).reshape(len(team_weeks), len(slots))
+    return matrix, team_weeks, np.asarray(slots)
+
+
+@traced()
+def slot_counterfactuals(
+    player_df,
+    group_cols=("year", "week"),
+    team_col="owner",
+    opponent_col="opponent",
+    slot_col="slot_position",
+    points_col="points",
+):
+    """Would each matchup have ended differently without, or with the opponent's, slot?
+
+    One row per team-week and starting slot. Everything comes from one team-week by slot
+    matrix and the row of each team's opponent in it, so the cost grows with the number of
+    team-weeks instead of with a merge of every slot against every opponent slot.
+    """
+    group_cols = list(group_cols)
+    matrix, team_weeks, slots = slot_matrix(player_df, group_cols, team_col, slot_col, points_col)
+
+    # Row of each team-week's opponent in the same week
+    opponents = (
+        player_df[group_cols + [team_col, opponent_col]]
+        .drop_duplicates(group_cols + [team_col])
+        .astype(object)
+    )
+    opponent_of = pd.MultiIndex.from_frame(opponents[group_cols + [team_col]]).get_indexer(
+        team_weeks
+    )
+    opponent_keys = pd.MultiIndex.from_frame(
+        opponents[group_cols + [opponent_col]].iloc[opponent_of]
+    )
+    opponent_row = team_weeks.get_indexer(opponent_keys)
+    rows = np.flatnonzero(opponent_row >= 0)
+    opponent_row = opponent_row[rows]
+
+    own_matrix, opponent_matrix = matrix[rows], matrix[opponent_row]
+    margin = (own_matrix.sum(axis=1) - opponent_matrix.sum(axis=1))[:, None]
+    slot_edge = own_matrix - opponent_matrix
+    # Points are in hundredths, rounding keeps exact ties from landing either side of zero
+    won = margin.round(2) > 0
+    scenario_margins = {
+        "without_slot": margin - own_matrix,
+        "without_both_slots": margin - slot_edge,
+        "swapped_slot": margin - 2 * slot_edge,
+    }
+
+    n_team_weeks, n_slots = own_matrix.shape
+    table = team_weeks[rows].to_frame(index=False)
+    table[opponent_col] = np.asarray(team_weeks.get_level_values(-1))[opponent_row]
+    table = table.loc[table.index.repeat(n_slots)].reset_index(drop=True)
+    table[slot_col] = np.tile(slots, n_team_weeks)
+    table["slot_points"] = own_matrix.ravel()
+    table["opponent_slot_points"] = opponent_matrix.ravel()
+    table["margin"] = np.repeat(margin.ravel(), n_slots)
+    table["won"] = np.repeat(won.ravel(), n_slots)
+    for scenario, scenario_margin in scenario_margins.items():
+        table[f"won_{scenario}"] = (scenario_margin.round(2) > 0).ravel()
+    return table.round({"slot_points": 2, "opponent_slot_points": 2, "margin": 2})
+
+
+def counterfactual_summary(table, by=("slot_position",)):
+    """Matchups, wins and how many results flip under each scenario, per group
+
+    wins_lost_without_slot counts the wins that the slot was needed for.
+    """
+    by = list(by)
+    counts = table[by].assign(
+        matchups=1,
+        wins=table["won"],
+        wins_lost_without_slot=table["won"] & ~table["won_without_slot"],
+        **{f"flips_{scenario}": table["won"] != table[f"won_{scenario}"] for scenario in SCENARIOS},
+    )
+    return counts.groupby(by, as_index=False, observed=True)[SUMMARY_COLS].sum()
+
+
+def flip_rates(summary, by=("slot_position",)):
+    """Share of matchups whose result flips under each scenario, from counterfactual_summary"""
+    by = list(by)
+    totals = summary.groupby(by, observed=True)[SUMMARY_COLS].sum()
+    rates = totals[[f"flips_{scenario}" for scenario in SCENARIOS]].div(totals["matchups"], axis=0)
+    return rates.rename(columns=lambda col: col.replace("flips_", "")).reset_index()
@@ -0,0 +1,153 @@
+import pickle
+import time
+from types import SimpleNamespace
+
+import pandas as pd
+
+
+def owner_team(owner):
+    """Stand-in for an espn_api Team with a single owner"""
+    first_name, _, last_name = owner.partition(" ")
+    return SimpleNamespace(owners=[{"firstName": first_name, "lastName": last_name}])
+
+
+def lineup_from_rows(rows):
+    """Stand-in for an espn_api lineup built from player_data rows"""
+    return [
+        SimpleNamespace(
+            name=row.player_name,
+            playerId=row.player_id,
+            position=row.player_position,
+            slot_position=row.slot_position,
+            projected_points=row.projected_points,
+            points=row.points,
+        )
+        for row in rows.itertuples()
+    ]
+
+
+def lineup_score(rows):
+    """Points scored by the starters of a lineup"""
+    return round(rows.loc[~rows.slot_position.isin(["BE", "IR"]), "points"].sum(), 2)
+
+
+def box_scores_from_player_data(player_data):
+    """Rebuild each week's box scores from a full_player_data csv"""
+    box_scores = {}
+    for week, week_rows in player_data.groupby("week"):
+        matchups = []
+        seen = set()
+        for owner, home_rows in week_rows.groupby("owner", sort=False):
+            opponent = home_rows.opponent.iloc[0]
+            if opponent in seen:
+                continue
+            seen.update([owner, opponent])
+            away_rows = week_rows[week_rows.owner == opponent]
+            matchups.append(
+                SimpleNamespace(
+                    home_team=owner_team(owner),
+                    away_team=owner_team(opponent),
+                    home_score=lineup_score(home_rows),
+                    away_score=lineup_score(away_rows),
+                    home_lineup=lineup_from_rows(home_rows),
+                    away_lineup=lineup_from_rows(away_rows),
+                )
+            )
+        box_scores[int(week)] = matchups
+    return box_scores
+
+
+class FakeLeague:
+    """Offline stand-in for espn_api's League that serves recorded box scores
+
+    Every box_scores and recent_activity call sleeps for latency seconds to mimic the ESPN
+    round trip. Weeks that were not recorded come back with zero scores, like future weeks
+    do on ESPN. activities is a newest first list like recent_activity returns.
+    """
+
+    def __init__(
+        self, box_scores, year, league_id=0, current_week=None, latency=0.0, activities=None
+    ):
+        self.league_id = league_id
+        self.year = year
+        self.latency = latency
+        self.calls = 0
+        self._box_scores = box_scores
+        self._activities = activities or []
+        self.current_week = current_week or max(box_scores) + 1
+
+    @classmethod
+    def from_player_data(cls, path, **kwargs):
+        """Serve the box scores from a fantasy/full_player_data/player_data_{year}.csv"""
+        player_data = pd.read_csv(path)
+        year = int(player_data.year.iloc[0])
+        return cls(box_scores_from_player_data(player_data), year, **kwargs)
+
+    @classmethod
+    def from_recording(cls, path, **kwargs):
+        """Serve the box scores saved by record_league"""
+        with open(path, "rb") as handle:
+            recording = pickle.load(handle)
+        return cls(recording["box_scores"], recording["year"], **kwargs)
+
+    def recent_activity(self, size=25, msg_type=None, offset=0):
+        self.calls += 1
+        time.sleep(self.latency)
+        return self._activities[offset : offset + size]
+
+    def box_scores(self, week):
+        self.calls += 1
+        time.sleep(self.latency)
+        if week in self._box_scores:
+            return self._box_scores[week]
+
+        # Unplayed weeks keep the rosters but every score is zero
+        empty_week = []
+        for match in next(iter(self._box_scores.values())):
+            empty_week.append(
+                SimpleNamespace(
+                    home_team=match.home_team,
+                    away_team=match.away_team,
+                    home_score=0,
+                    away_score=0,
+                    home_lineup=[
+                        SimpleNamespace(**{**vars(p), "points": 0}) for p in match.home_lineup
+                    ],
+                    away_lineup=[
+                        SimpleNamespace(**{**vars(p), "points": 0}) for p in match.away_lineup
+                    ],
+                )
+            )
+        return empty_week
+
+
+def record_league(league, weeks, path):
+    """Save a real league's box scores so FakeLeague can replay them offline"""
+    recording = {
+        "year": league.year,
+        "box_scores": {week: league.box_scores(week) for week in weeks},
+    }
+    with open(path, "wb") as handle:
+        pickle.dump(recording, handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+if __name__ == "__main__":
+    from .get_espn_data import box_score_cache, get_season_data
+
+    # Compare sequential and concurrent week fetching against the same recorded season
+    sequential = None
+    for max_workers in [1, 4, 8]:
+        league = FakeLeague.from_player_data(
+            "fantasy/full_player_data/player_data_2020.csv", latency=0.2
+        )
+        box_score_cache.clear()
+        start = time.perf_counter()
+        season_data = get_season_data(league.year, league, max_workers=max_workers)
+        elapsed = time.perf_counter() - start
+        if sequential is None:
+            sequential = season_data
+        identical = season_data.equals(sequential)
+        print(
+            f"max_workers={max_workers}: {elapsed:.2f}s, {league.calls} box_scores calls, "
+            f"identical to sequential: {identical}"
+        )
@@ -1,8 +1,8 @@
 import pandas as pd
 import random
 import numpy as np
-from toolz.itertoolz import random_sample
-import streamlit as st
+from .schema import team_week_table
+from .tracing import traced
 
 
 def split(df, col):
@@ -57,8 +57,254 @@ def simulate_season(team_name, team_dict, top6_dict):
     return all_wins
 
 
-def build_probability_distribution(ffdata):
-    """Simulate the seasons for all of the teams"""
+def build_score_matrices(ffdata):
+    """Create a team x week matrix of points and of top 6 wins, teams sorted by name"""
+    team_weeks = team_week_table(ffdata)
+    points = team_weeks.pivot(index="team_name", columns="week", values="points").sort_index()
+    top6 = team_weeks.pivot(index="team_name", columns="week", values="top6_win").sort_index()
+    return [str(name) for name in points.index], points.to_numpy(float), top6.to_numpy(int)
+
+
+def draw_schedules(rng, n_sims, n_teams, games_count, teams=None):
+    """Draw random opponent schedules for every team as an (n_sims, teams, games) array
+
+    Mirrors simulate_season: each block of n_teams - 1 games is a random order of all
+    opponents, and the final partial block is a sample without replacement. Pass teams
+    to only draw schedules for those team indices.
+    """
+    teams = np.arange(n_teams) if teams is None else np.asarray(teams)
+    n_opponents = n_teams - 1
+    n_blocks = -(-games_count // n_opponents)
+    keys = rng.random((n_sims, len(teams), n_blocks, n_opponents), dtype=np.float32)
+    local = keys.argsort(axis=-1).astype(np.int16).reshape(n_sims, len(teams), -1)
+    local = local[:, :, :games_count]
+
+    # Map the position in each team's opponent list back to a team index
+    others = np.array([[j for j in range(n_teams) if j != i] for i in range(n_teams)])
+    return others[teams[:, None], local]
+
+
+@traced()
+def simulate_win_counts(points, top6, n_sims=10000, rng=None, batch_size=2000, teams=None):
+    """Simulate n_sims seasons for every team at once and return an (n_sims, teams) array of wins
+
+    Pass teams to only simulate those team indices.
+    """
+    rng = np.random.default_rng(rng)
+    n_teams, games_count = points.shape
+    teams = np.arange(n_teams) if teams is None else np.asarray(teams)
+    weeks = np.arange(games_count)
+    top6_wins = top6[teams].sum(axis=1)
+
+    all_wins = []
+    for start in range(0, n_sims, batch_size):
+        batch = min(batch_size, n_sims - start)
+        opponents = draw_schedules(rng, batch, n_teams, games_count, teams=teams)
+        h2h_wins = (points[None, teams, :] > points[opponents, weeks]).sum(axis=2)
+        all_wins.append(h2h_wins + top6_wins)
+    return np.concatenate(all_wins)
+
+
+def control_variate_at_least(counts, top6_wins, expected_h2h):
+    """Probability of at least X wins per team from win counts, and the standard error of each
+
+    Each week's opponent is uniform over the other teams, so every team's expected number of
+    head to head wins is known exactly. Every cell is corrected by how far the sample's
+    mean head to head wins are from it, times the cell's regression slope on them, which
+    removes the part of the sampling noise the two share. The standard error is the one of
+    the regression residual, so it stays correct for the corrected estimate.
+    """
+    samples = counts.sum(axis=0)
+    h2h = np.arange(counts.shape[0])[:, None] - top6_wins[None, :]
+    mean_h2h = (counts * h2h).sum(axis=0) / samples
+    var_h2h = (counts * h2h**2).sum(axis=0) / samples - mean_h2h**2
+
+    at_least = counts[::-1].cumsum(axis=0)[::-1] / samples
+    cov = (counts * h2h)[::-1].cumsum(axis=0)[::-1] / samples - at_least * mean_h2h
+    slope = np.divide(cov, var_h2h, out=np.zeros_like(cov), where=var_h2h > 0)
+    residual_var = (at_least * (1 - at_least) - slope * cov).clip(0, None)
+    std_error = np.sqrt(residual_var / samples)
+
+    # Keep the corrected table a valid cumulative distribution
+    at_least = (at_least - slope * (mean_h2h - expected_h2h)).clip(0, 1)
+    at_least = np.maximum.accumulate(at_least[::-1], axis=0)[::-1]
+    return at_least, std_error
+
+
+def simulate_adaptive(
+    points, top6, max_wins, tolerance=0.005, batch_size=1000, max_sims=100000, rng=None
+):
+    """Simulate in batches until every cell of a team's cumulative table is precise enough
+
+    A team stops once the largest standard error of its "at least X wins" probabilities
+    is at or below tolerance, or once it reaches max_sims. The probabilities use head to
+    head wins as a control variate (see control_variate_at_least), which needs far fewer
+    samples than plain counting for the same standard error. Returns the probability of
+    each win total as a (wins, teams) array, the samples each team used and its final
+    standard error.
+    """
+    rng = np.random.default_rng(rng)
+    n_teams, games_count = points.shape
+    weeks = np.arange(games_count)
+    top6_wins = top6.sum(axis=1)
+    expected_h2h = weekly_win_probabilities(points).sum(axis=1)
+
+    counts = np.zeros((max_wins + 1, n_teams))
+    samples_used = np.zeros(n_teams, dtype=int)
+    std_error = np.ones(n_teams)
+    active = np.arange(n_teams)
+    while active.size:
+        opponents = draw_schedules(rng, batch_size, n_teams, games_count, teams=active)
+        h2h_wins = (points[None, active, :] > points[opponents, weeks]).sum(axis=2)
+        all_wins = h2h_wins + top6_wins[active]
+        for k, team in enumerate(active):
+            counts[:, team] += np.bincount(all_wins[:, k], minlength=max_wins + 1)[: max_wins + 1]
+        samples_used[active] += batch_size
+
+        _, cell_errors = control_variate_at_least(
+            counts[:, active], top6_wins[active], expected_h2h[active]
+        )
+        std_error[active] = cell_errors.max(axis=0)
+        active = active[(std_error[active] > tolerance) & (samples_used[active] < max_sims)]
+
+    at_least, _ = control_variate_at_least(counts, top6_wins, expected_h2h)
+    return (
+        at_least - np.append(at_least[1:], np.zeros((1, n_teams)), axis=0),
+        samples_used,
+        std_error,
+    )
+
+
+def adaptive_probability_distribution(
+    ffdata, tolerance=0.005, batch_size=1000, max_sims=100000, seed=None
+):
+    """Adaptive version of build_probability_distribution that also reports samples per team
+
+    The report compares each team's samples with the fixed 10,000 simulations.
+    """
+    max_wins = ffdata.week.max() * 2
+    team_names, points, top6 = build_score_matrices(ffdata)
+    dist, samples_used, std_error = simulate_adaptive(
+        points,
+        top6,
+        max_wins,
+        tolerance=tolerance,
+        batch_size=batch_size,
+        max_sims=max_sims,
+        rng=seed,
+    )
+    prob_table = pd.DataFrame(dist, index=range(0, max_wins + 1), columns=team_names)
+    sample_report = pd.DataFrame(
+        {
+            "samples_used": samples_used,
+            "max_std_error": std_error,
+            "saved_vs_fixed": 1 - samples_used / 10000,
+        },
+        index=team_names,
+    )
+    return prob_table, sample_report
+
+
+def wins_to_prob_table(all_wins, team_names, max_wins):
+    """Turn an (n_sims, teams) array of wins into the probability table for each win total"""
+    counts = np.stack(
+        [
+            np.bincount(all_wins[:, i], minlength=max_wins + 1)[: max_wins + 1]
+            for i in range(len(team_names))
+        ],
+        axis=1,
+    )
+    return pd.DataFrame(counts / len(all_wins), index=range(0, max_wins + 1), columns=team_names)
+
+
+def weekly_win_probabilities(points):
+    """Chance of beating a random opponent each week, as a (teams, games) array"""
+    n_teams = points.shape[0]
+    beaten = (points[:, None, :] > points[None, :, :]).sum(axis=1)
+    return beaten / (n_teams - 1)
+
+
+@traced()
+def exact_win_distribution(points, top6, max_wins):
+    """Exact distribution of wins when each week's opponent is drawn at random
+
+    Every week is an independent Bernoulli trial against the other teams' scores, so the
+    head to head wins are Poisson-binomial. Convolve the weeks one at a time for all teams.
+    """
+    win_probs = weekly_win_probabilities(points)
+    n_teams, games_count = win_probs.shape
+    h2h_dist = np.zeros((n_teams, games_count + 1))
+    h2h_dist[:, 0] = 1
+    for week in range(games_count):
+        p = win_probs[:, week, None]
+        h2h_dist[:, 1:] = h2h_dist[:, 1:] * (1 - p) + h2h_dist[:, :-1] * p
+        h2h_dist[:, 0] *= 1 - p[:, 0]
+
+    # Top 6 wins are fixed, so they shift each team's distribution
+    dist = np.zeros((max_wins + 1, n_teams))
+    for i, shift in enumerate(top6.sum(axis=1)):
+        dist[shift : shift + games_count + 1, i] = h2h_dist[i, : max_wins + 1 - shift]
+    return dist
+
+
+def cumulative_table(prob_table):
+    """Probability of having at least X wins, as rendered in the Matchup Luck table"""
+    return prob_table.sort_index(ascending=False).cumsum(axis=0).sort_index(ascending=True)
+
+
+def compare_exact_to_sampled(ffdata, n_sims=10000, seed=None):
+    """Per team gap between the exact and the sampled cumulative tables
+
+    Reports the largest and mean absolute difference next to the largest Monte Carlo
+    standard error, so a gap well above the standard error comes from the model and not
+    from sampling noise.
+    """
+    exact = cumulative_table(build_probability_distribution(ffdata, method="exact"))
+    sampled = cumulative_table(
+        build_probability_distribution(ffdata, method="vectorized", n_sims=n_sims, seed=seed)
+    )
+    diff = (exact - sampled).abs()
+    std_error = np.sqrt(sampled.clip(0, 1) * (1 - sampled.clip(0, 1)) / n_sims)
+    return pd.DataFrame(
+        {
+            "max_abs_diff": diff.max(),
+            "mean_abs_diff": diff.mean(),
+            "max_std_error": std_error.max(),
+        }
+    )
+
+
+@traced()
+def build_probability_distribution(ffdata, method="vectorized", n_sims=10000, seed=None):
+    """Simulate the seasons for all of the teams
+
+    method="vectorized" draws every schedule for every team at once with numpy; use a
+    fixed seed to get the same table on every rerun. method="exact" computes the
+    distribution with a random opponent every week without sampling. method="adaptive"
+    stops each team once the standard error of every cell of its table is at most 0.5
+    percentage points, using head to head wins as a control variate. method="python"
+    is the original loop.
+    """
+    # Schedules need at least two teams, before then there is nothing to simulate
+    if ffdata["team_name"].nunique() < 2:
+        return pd.DataFrame(
+            columns=[str(name) for name in ffdata["team_name"].unique()], dtype=float
+        )
+
+    max_wins = ffdata.week.max() * 2
+    if method == "adaptive":
+        return adaptive_probability_distribution(ffdata, seed=seed)[0]
+    elif method == "exact":
+        team_names, points, top6 = build_score_matrices(ffdata)
+        dist = exact_win_distribution(points, top6, max_wins)
+        return pd.DataFrame(dist, index=range(0, max_wins + 1), columns=team_names)
+    elif method == "vectorized":
+        team_names, points, top6 = build_score_matrices(ffdata)
+        all_wins = simulate_win_counts(points, top6, n_sims=n_sims, rng=seed)
+        return wins_to_prob_table(all_wins, team_names, max_wins)
+    elif method != "python":
+        raise ValueError(f"Unknown method: {method}")
+
     raw_scores = ffdata[["team_name", "week", "points"]].drop_duplicates()
     team_dict = create_team_dict(raw_scores)
     top6_dict = create_top6_dict(ffdata)
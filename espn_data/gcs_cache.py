@@ -0,0 +1,161 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from .tracing import span
+
+
+class BlobCache:
+    """Two tier cache of GCS blobs: parsed values in memory and raw bytes on local disk
+
+    Entries are keyed by the blob's generation, so a new upload is picked up as soon as the
+    cache revalidates instead of after a fixed TTL. Revalidating costs one metadata request
+    and is skipped for revalidate_after seconds after the last check.
+    """
+
+    def __init__(self, maxsize=32, cache_dir=".cache/gcs", revalidate_after=30):
+        self.maxsize = maxsize
+        self.cache_dir = cache_dir
+        self.revalidate_after = revalidate_after
+        self._memory = OrderedDict()
+        self._listings = {}
+        self._lock = threading.Lock()
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "revalidations": 0,
+            "request_seconds": 0.0,
+        }
+
+    def _count(self, counter, seconds=0.0):
+        with self._lock:
+            self.counters[counter] += 1
+            self.counters["request_seconds"] += seconds
+
+    def _disk_path(self, key, generation):
+        return os.path.join(self.cache_dir, key.replace("/", "__") + f".{generation}")
+
+    def _remember(self, key, generation, value):
+        with self._lock:
+            self._memory[key] = (generation, time.monotonic(), value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.maxsize:
+                self._memory.popitem(last=False)
+
+    def _fresh(self, key):
+        """Memory entry that was checked against GCS less than revalidate_after seconds ago"""
+        with self._lock:
+            entry = self._memory.get(key)
+        if entry is not None and time.monotonic() - entry[1] < self.revalidate_after:
+            return entry
+        return None
+
+    def get_blob(self, blob, parse=bytes, variant=""):
+        """Parsed contents of a blob whose metadata (generation) is already loaded"""
+        key = f"{blob.bucket.name}/{blob.name}{variant}"
+        with self._lock:
+            entry = self._memory.get(key)
+        if entry is not None and entry[0] == blob.generation:
+            self._remember(key, blob.generation, entry[2])
+            self._count("memory_hits")
+            return entry[2]
+
+        disk_path = self._disk_path(f"{blob.bucket.name}/{blob.name}", blob.generation)
+        data = self._read_disk(disk_path)
+        if data is not None:
+            self._count("disk_hits")
+        else:
+            start = time.perf_counter()
+            with span("gcs.download", blob=blob.name):
+                data = blob.download_as_bytes()
+            self._count("misses", time.perf_counter() - start)
+            self._write_disk(f"{blob.bucket.name}/{blob.name}", blob.generation, data)
+
+        value = parse(data)
+        self._remember(key, blob.generation, value)
+        return value
+
+    @staticmethod
+    def _read_disk(disk_path):
+        """Cached bytes, None if the file is not there (or was just replaced by a newer one)"""
+        try:
+            with open(disk_path, "rb") as handle:
+                return handle.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_disk(self, name_key, generation, data):
+        """Store the bytes for this generation and drop any older generations
+
+        The bytes go to a temporary file that is renamed into place, so threads reading the
+        cache never see a partly written file.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        disk_path = self._disk_path(name_key, generation)
+        handle, temp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".partial-")
+        try:
+            with os.fdopen(handle, "wb") as temp_file:
+                temp_file.write(data)
+            os.replace(temp_path, disk_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        prefix = os.path.basename(self._disk_path(name_key, ""))
+        for old_file in os.listdir(self.cache_dir):
+            if old_file.startswith(prefix) and old_file != os.path.basename(disk_path):
+                # Another thread may have removed it already
+                try:
+                    os.remove(os.path.join(self.cache_dir, old_file))
+                except FileNotFoundError:
+                    pass
+
+    def get(self, store, name, parse=bytes, variant=""):
+        """Parsed contents of an object in a storage gateway, None if it does not exist"""
+        entry = self._fresh(f"{store.name}/{name}{variant}")
+        if entry is not None:
+            self._count("memory_hits")
+            return entry[2]
+
+        start = time.perf_counter()
+        blob = store.get_blob(name)
+        self._count("revalidations", time.perf_counter() - start)
+        if blob is None:
+            return None
+        return self.get_blob(blob, parse=parse, variant=variant)
+
+    def get_prefix(self, store, prefix, parse=bytes, variant=""):
+        """Parsed contents of every object under a prefix, in name order"""
+        listing_key = f"{store.name}/{prefix}"
+        with self._lock:
+            listing = self._listings.get(listing_key)
+        if listing is None or time.monotonic() - listing[0] >= self.revalidate_after:
+            start = time.perf_counter()
+            blobs = store.list_blobs(prefix)
+            self._count("revalidations", time.perf_counter() - start)
+            listing = (time.monotonic(), blobs)
+            with self._lock:
+                self._listings[listing_key] = listing
+        return [self.get_blob(blob, parse=parse, variant=variant) for blob in listing[1]]
+
+    def invalidate(self, bucket_name, name=""):
+        """Forget memory entries and listings for a blob or prefix, e.g. after an upload"""
+        key_prefix = f"{bucket_name}/{name}"
+        with self._lock:
+            for key in [key for key in self._memory if key.startswith(key_prefix)]:
+                del self._memory[key]
+            for key in [key for key in self._listings if key.startswith(key_prefix)]:
+                del self._listings[key]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters, memory_entries=len(self._memory))
+        logging.info(f"GCS cache {stats}")
+        return stats
+
+
+blob_cache = BlobCache()
@@ -1,104 +1,146 @@
 from logging import debug
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from itertools import islice
+import threading
 import pandas as pd
-import numpy as np
-from datetime import datetime, timedelta
-import streamlit as st
-from espn_api.football import League
-
-
-def box_score_to_csv(box_match, week, year, our_league):
-    our_league.refresh()
-    box_match_1 = box_match
-    name = ["tp1", "tp2", "tp3"]
-    week_scores = our_league.box_scores(week)
-
-    # Home team
-    home_points = box_match_1.home_score
-    home_team_name = (
-        box_match_1.home_team.owners[0]["firstName"]
-        + " "
-        + box_match_1.home_team.owners[0]["lastName"]
+from datetime import datetime
+from .transactions import owner_name
+from .tracing import span, traced
+
+
+class BoxScoreCache:
+    """Bounded LRU cache of league.box_scores, fetched once per (league, year, week)"""
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._scores = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, league, week, refresh=False):
+        """Return the box scores for a week, calling ESPN only on a miss or a refresh"""
+        key = (league.league_id, league.year, week)
+        with self._lock:
+            if key in self._scores and not refresh:
+                self.hits += 1
+                self._scores.move_to_end(key)
+                return self._scores[key]
+            self.misses += 1
+
+        # Fetch outside the lock so other weeks can download at the same time
+        with span("espn.box_scores", year=league.year, week=week):
+            week_scores = league.box_scores(week)
+        with self._lock:
+            self._scores[key] = week_scores
+            self._scores.move_to_end(key)
+            while len(self._scores) > self.maxsize:
+                self._scores.popitem(last=False)
+        return week_scores
+
+    def clear(self):
+        with self._lock:
+            self._scores.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._scores)}
+
+
+box_score_cache = BoxScoreCache()
+
+
+TEAM_WEEK_COLS = [
+    "team_name",
+    "week",
+    "points",
+    "opponent",
+    "h2h_win",
+    "points_against",
+    "top6_win",
+    "weekly_rank",
+    "year",
+]
+SEASON_CSV_COLS = [
+    "team_name",
+    "week",
+    "points",
+    "name",
+    "tp_names",
+    "tp_points",
+    "opponent",
+    "h2h_win",
+    "points_against",
+    "top6_win",
+    "year",
+]
+
+
+def box_score_rows(week_box_scores):
+    """Flatten {week: box_scores} into a team-week table and a player table"""
+    teams = {"team_name": [], "week": [], "points": [], "opponent": [], "points_against": []}
+    players = {"team_name": [], "week": [], "tp_names": [], "tp_points": []}
+    for week, matchups in week_box_scores.items():
+        for match in matchups:
+            home_name = owner_name(match.home_team)
+            away_name = owner_name(match.away_team)
+            sides = [
+                (home_name, match.home_score, away_name, match.away_score, match.home_lineup),
+                (away_name, match.away_score, home_name, match.home_score, match.away_lineup),
+            ]
+            for team_name, points, opponent, points_against, lineup in sides:
+                teams["team_name"].append(team_name)
+                teams["week"].append(week)
+                teams["points"].append(points)
+                teams["opponent"].append(opponent)
+                teams["points_against"].append(points_against)
+                players["team_name"].extend([team_name] * len(lineup))
+                players["week"].extend([week] * len(lineup))
+                players["tp_names"].extend(player.name for player in lineup)
+                players["tp_points"].extend(player.points for player in lineup)
+    return pd.DataFrame(teams), pd.DataFrame(players)
+
+
+@traced()
+def build_season_tables(week_box_scores, year):
+    """Team-week facts and top 3 performers for every team-week of a season in one pass
+
+    weekly_rank is 1 for the top score of the week, ties share the better rank, and a top 6
+    win is a rank of 6 or better.
+    """
+    team_weeks, players = box_score_rows(week_box_scores)
+    team_weeks["h2h_win"] = team_weeks["points"] > team_weeks["points_against"]
+    team_weeks["weekly_rank"] = (
+        team_weeks.groupby("week")["points"].rank(method="min", ascending=False).astype(int)
     )
+    team_weeks["top6_win"] = team_weeks["weekly_rank"] <= 6
+    team_weeks["year"] = year
 
-    home_player_points = []
-    for player in box_match_1.home_lineup:
-        home_player_points.append([player.name, player.points])
-    player_df = pd.DataFrame(home_player_points, columns=["player", "points"]).sort_values(
-        "points", ascending=False
+    players = players.sort_values(
+        ["week", "team_name", "tp_points"], ascending=[True, True, False], kind="stable"
     )
-    home_top_3_players = player_df.head(3).player.to_list()
-    home_top_3_player_points = player_df.head(3).points.to_list()
-
-    # Away team
-    away_points = box_match_1.away_score
-    away_team_name = (
-        box_match_1.away_team.owners[0]["firstName"]
-        + " "
-        + box_match_1.away_team.owners[0]["lastName"]
+    performer_rank = players.groupby(["week", "team_name"]).cumcount()
+    top_performers = players[performer_rank < 3].assign(
+        name="tp" + (performer_rank[performer_rank < 3] + 1).astype(str), year=year
     )
+    top_performers = top_performers[["team_name", "week", "name", "tp_names", "tp_points", "year"]]
+    return team_weeks[TEAM_WEEK_COLS], top_performers.reset_index(drop=True)
 
-    away_player_points = []
-    for player in box_match_1.away_lineup:
-        away_player_points.append([player.name, player.points])
-    player_df = pd.DataFrame(away_player_points, columns=["player", "points"]).sort_values(
-        "points", ascending=False
+
+def season_csv_view(team_weeks, top_performers):
+    """The fantasy_data csv layout the app reads: one row per team-week and top performer"""
+    season_csv = team_weeks.merge(
+        top_performers.drop(columns="year"), on=["team_name", "week"], how="left", sort=False
     )
-    away_top_3_players = player_df.head(3).player.to_list()
-    away_top_3_player_points = player_df.head(3).points.to_list()
-
-    home_h2h_win = home_points > away_points
-    away_h2h_win = home_points < away_points
-
-    # Top 6 scores
-    weekly_scores = []
-    for match in week_scores:
-        weekly_scores.extend([match.home_score, match.away_score])
-    weekly_scores = np.array(weekly_scores)
-    weekly_scores.sort()
-
-    home_top6_win = home_points >= weekly_scores[-6]
-    away_top6_win = away_points >= weekly_scores[-6]
-
-    # Create the DF
-    team_data = [
-        [home_team_name] * 3 + [away_team_name] * 3,
-        [week] * 6,
-        [home_points] * 3 + [away_points] * 3,
-        name + name,
-        home_top_3_players + away_top_3_players,
-        home_top_3_player_points + away_top_3_player_points,
-        [away_team_name] * 3 + [home_team_name] * 3,
-        [home_h2h_win] * 3 + [away_h2h_win] * 3,
-        [away_points] * 3 + [home_points] * 3,
-        [bool(home_top6_win)] * 3 + [bool(away_top6_win)] * 3,
-        [year] * 6,
-    ]
-    # Columns
-    team_cols = [
-        "team_name",
-        "week",
-        "points",
-        "name",
-        "tp_names",
-        "tp_points",
-        "opponent",
-        "h2h_win",
-        "points_against",
-        "top6_win",
-        "year",
-    ]
-    team_dict = {key: value for key, value in zip(team_cols, team_data)}
-    return pd.DataFrame(team_dict)
-
-
-def full_week_data(week, year, league):
-    match_data = []
-    week_scores = league.box_scores(week)
-
-    for match in week_scores:
-        match_data.append(box_score_to_csv(match, week, year, league))
-    combined_matches = pd.concat(match_data)
-    return combined_matches
+    return season_csv[SEASON_CSV_COLS]
+
+
+@traced()
+def full_week_data(week, year, league, refresh=True):
+    week_scores = box_score_cache.get(league, week, refresh=refresh)
+    team_weeks, top_performers = build_season_tables({week: week_scores}, year)
+    return season_csv_view(team_weeks, top_performers)
 
 
 def weeks_since_start_season():
@@ -109,26 +151,84 @@ def weeks_since_start_season():
     return total_diff.days // 7
 
 
-def get_season_data(year, league):
+def completed_weeks(league, total_weeks=14):
+    """Regular season weeks that ESPN has finished scoring"""
+    return range(1, min(league.current_week - 1, total_weeks) + 1)
+
+
+def last_completed_week(season_data, league):
+    """Watermark: the last stored week that ESPN has finished scoring, 0 if nothing is stored"""
+    if season_data is None or len(season_data) == 0:
+        return 0
+    return int(min(season_data["week"].max(), league.current_week - 1))
+
+
+def fetch_weeks(weeks, year, league, max_workers=1):
+    """Week data for each week in order, downloading up to max_workers weeks at a time
+
+    Only max_workers weeks are requested ahead of the caller, and closing the generator
+    cancels the ones that have not started, so stopping at the end of the season does not
+    download the rest of the weeks.
+    """
+    if max_workers <= 1:
+        for week in weeks:
+            yield full_week_data(week, year, league)
+        return
+
+    weeks = iter(weeks)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque(
+            executor.submit(full_week_data, week, year, league)
+            for week in islice(weeks, max_workers)
+        )
+        try:
+            while pending:
+                weekly_data = pending.popleft().result()
+                for week in islice(weeks, 1):
+                    pending.append(executor.submit(full_week_data, week, year, league))
+                yield weekly_data
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+@traced()
+def get_season_data(year, league, existing=None, max_workers=1, on_week=None):
+    """Download the season week by week until the weeks stop changing
+
+    Pass the stored season as existing to only fetch the weeks after its watermark. Stored
+    weeks up to the watermark are kept as they are and later weeks are replaced, so running
+    it again with the same data gives the same result. With max_workers > 1 the weeks are
+    downloaded concurrently and then checked in week order, so the result is the same.
+    on_week(week, weekly_data) is called for every week that is kept, in week order.
+    """
     our_league = league
 
     total_weeks = 14
+    watermark = last_completed_week(existing, our_league)
 
     all_data = []
-    for i in range(1, total_weeks + 1):
-        weekly_data = full_week_data(i, year, our_league)
-        print(i)
-        if len(all_data) > 0:
-            if (
-                weekly_data.points_against.sum() == 0
-                or weekly_data.points_against.sum() == all_data[-1].points_against.sum()
-            ):
-                break
+    if watermark > 0:
+        all_data.append(existing[existing.week == watermark])
+    weeks = range(watermark + 1, total_weeks + 1)
+    with closing(fetch_weeks(weeks, year, our_league, max_workers)) as fetched:
+        for i, weekly_data in zip(weeks, fetched):
+            debug(f"Fetched week {i}")
+            if len(all_data) > 0:
+                if (
+                    weekly_data.points_against.sum() == 0
+                    or weekly_data.points_against.sum() == all_data[-1].points_against.sum()
+                ):
+                    break
+                else:
+                    all_data.append(weekly_data)
+
             else:
                 all_data.append(weekly_data)
+            if on_week is not None and all_data[-1] is weekly_data:
+                on_week(i, weekly_data)
 
-        else:
-            all_data.append(weekly_data)
-
+    if watermark > 0:
+        all_data[0] = existing[existing.week <= watermark]
     season_data = pd.concat(all_data).query("points_against > 1")
     return season_data
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+
+from .tracing import traced
+
+# Starting slots and how many of each; any slot that is not a position must be in FLEX_POSITIONS
+DEFAULT_SLOTS = {"QB": 1, "RB": 2, "WR": 2, "TE": 1, "FLEX": 1, "D/ST": 1}
+SUPERFLEX_SLOTS = {"QB": 1, "RB": 2, "WR": 2, "TE": 1, "FLEX": 1, "OP": 1, "D/ST": 1}
+FLEX_POSITIONS = {
+    "FLEX": ["RB", "WR", "TE"],
+    "RB/WR/TE": ["RB", "WR", "TE"],
+    "RB/WR": ["RB", "WR"],
+    "WR/TE": ["WR", "TE"],
+    "OP": ["QB", "RB", "WR", "TE"],
+}
+BENCH_SLOTS = ["BE", "IR"]
+
+
+@traced()
+def mark_optimal_lineups(
+    player_df,
+    slots=DEFAULT_SLOTS,
+    group_cols=("year", "week", "owner"),
+    pos_col="player_position",
+    points_col="points",
+):
+    """Mark the highest scoring legal lineup for every team-week at once
+
+    Players are ranked by points within each team-week and position. The top players of
+    each position fill its dedicated slots, then the flex slots are filled in the order of
+    slots from whoever is left. Adds ideal_player and ideal_slot and keeps the row order.
+    """
+    group_cols = list(group_cols)
+    order = np.lexsort(
+        [-player_df[points_col].to_numpy(dtype=float)]
+        + [player_df[col].to_numpy() for col in reversed(group_cols)]
+    )
+    ranked = player_df.iloc[order].reset_index(drop=True)
+    positions = ranked[pos_col]
+
+    ideal_slot = pd.Series(None, index=ranked.index, dtype="object")
+    position_rank = ranked.groupby(group_cols + [pos_col], sort=False, observed=True).cumcount()
+    for slot, count in slots.items():
+        if slot in FLEX_POSITIONS:
+            continue
+        ideal_slot[(positions == slot) & (position_rank < count)] = slot
+
+    for slot, count in slots.items():
+        if slot not in FLEX_POSITIONS:
+            continue
+        candidates = ideal_slot.isna() & positions.isin(FLEX_POSITIONS[slot])
+        flex_rank = ranked[candidates].groupby(group_cols, sort=False, observed=True).cumcount()
+        ideal_slot[flex_rank[flex_rank < count].index] = slot
+
+    # Put the slots back in the original row order
+    slot_values = np.empty(len(order), dtype="object")
+    slot_values[order] = ideal_slot.to_numpy()
+    marked = player_df.copy()
+    marked["ideal_slot"] = slot_values
+    marked["ideal_player"] = marked["ideal_slot"].notna()
+    return marked
+
+
+def optimal_lineup_summary(
+    marked,
+    group_cols=("year", "week", "owner"),
+    slot_col="slot_position",
+    points_col="points",
+):
+    """Actual points, optimal points and points left on the bench for each team-week"""
+    group_cols = list(group_cols)
+    started = ~marked[slot_col].isin(BENCH_SLOTS)
+    summary = (
+        marked.assign(
+            actual_points=marked[points_col].where(started, 0),
+            optimal_points=marked[points_col].where(marked["ideal_player"], 0),
+        )
+        .groupby(group_cols, as_index=False, observed=True)[["actual_points", "optimal_points"]]
+        .sum()
+    )
+    summary["bench_points"] = summary["optimal_points"] - summary["actual_points"]
+    return summary.round(2)
@@ -0,0 +1,108 @@
+import argparse
+import glob
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .ff_probability import build_score_matrices, simulate_win_counts
+from .schema import complete_weeks, load_season
+
+
+def load_archived_seasons(data_dir="fantasy"):
+    """Load the team-week table of every fantasy_data_{year}.csv, only weeks every team played"""
+    seasons = {}
+    for path in sorted(glob.glob(os.path.join(data_dir, "fantasy_data_*.csv"))):
+        year = int(re.search(r"fantasy_data_(\d{4})\.csv$", path).group(1))
+        seasons[year] = complete_weeks(load_season(pd.read_csv(path))).team_weeks
+    return seasons
+
+
+def actual_wins(team_weeks):
+    """Head to head plus top 6 wins for each team in a season"""
+    wins = team_weeks.groupby("team_name", observed=True)[["h2h_win", "top6_win"]].sum()
+    return wins.sum(axis=1).astype(int)
+
+
+def season_team_luck(task):
+    """Simulate one team's season and return its rows of the luck table"""
+    year, team_name, team_index, points, top6, team_wins, n_sims, seed = task
+    all_wins = simulate_win_counts(points, top6, n_sims=n_sims, rng=seed, teams=[team_index])
+    max_wins = points.shape[1] * 2
+    probability = np.bincount(all_wins[:, 0], minlength=max_wins + 1)[: max_wins + 1] / n_sims
+    return pd.DataFrame(
+        {
+            "year": year,
+            "team_name": team_name,
+            "wins": np.arange(max_wins + 1),
+            "probability": probability,
+            "at_least": probability[::-1].cumsum()[::-1],
+            "actual_wins": team_wins,
+        }
+    )
+
+
+def build_luck_tasks(seasons, n_sims=10000, base_seed=0):
+    """One task per (season, team), each with its own deterministic seed"""
+    tasks = []
+    for year, season in sorted(seasons.items()):
+        team_names, points, top6 = build_score_matrices(season)
+        wins = actual_wins(season)
+        for team_index, team_name in enumerate(team_names):
+            seed = np.random.SeedSequence([base_seed, year, team_index])
+            tasks.append((year, team_name, team_index, points, top6, wins[team_name], n_sims, seed))
+    return tasks
+
+
+def build_luck_history(seasons, n_sims=10000, base_seed=0, max_workers=None):
+    """Compute the luck table for every (season, team) pair in parallel
+
+    The result is long format with one row per season, team and win total. The seeds only
+    depend on base_seed, the year and the team, so the output does not change with the
+    number of workers.
+    """
+    tasks = build_luck_tasks(seasons, n_sims=n_sims, base_seed=base_seed)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(season_team_luck, tasks))
+    luck_history = pd.concat(results, ignore_index=True)
+    luck_history["team_name"] = luck_history["team_name"].astype("category")
+    luck_history["year"] = luck_history["year"].astype("int16")
+    luck_history["wins"] = luck_history["wins"].astype("int8")
+    luck_history["actual_wins"] = luck_history["actual_wins"].astype("int8")
+    for col in ["probability", "at_least"]:
+        luck_history[col] = luck_history[col].astype("float32")
+    return luck_history
+
+
+def luck_rankings(luck_history):
+    """Rank every season of every team by the chance of doing at least as well as they did
+
+    A low at_least means the team won more than most random schedules would give them.
+    """
+    actual = luck_history[luck_history["wins"] == luck_history["actual_wins"]]
+    return (
+        actual[["year", "team_name", "actual_wins", "at_least"]]
+        .sort_values("at_least")
+        .reset_index(drop=True)
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute the luck table for every season")
+    parser.add_argument("--data-dir", default="fantasy")
+    parser.add_argument("--output", default="fantasy/luck_history.parquet")
+    parser.add_argument("--n-sims", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    luck_history = build_luck_history(
+        load_archived_seasons(args.data_dir),
+        n_sims=args.n_sims,
+        base_seed=args.seed,
+        max_workers=args.workers,
+    )
+    luck_history.to_parquet(args.output, index=False)
+    print(f"Wrote {len(luck_history)} rows to {args.output}")
@@ -0,0 +1,187 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from .storage import PLAYER_STRING_COLS, compact_frame, read_player_data
+from .tracing import traced
+
+PLAYER_HISTORY_PATH = "fantasy/full_player_data/merged_full_data.csv"
+SORT_COLS = ["year", "week", "owner", "slot_position"]
+INDEX_COLS = ["week", "owner", "player_id", "slot_position", "player_position"]
+VALUE_COLS = ["points", "projected_points"]
+
+
+class PostingIndex:
+    """Row positions for every value of a column: one array of positions plus offsets
+
+    The positions of value code c are order[offsets[c]:offsets[c + 1]], in row order.
+    """
+
+    def __init__(self, codes, n_values):
+        self.order = np.argsort(codes, kind="stable").astype(np.int32)
+        self.offsets = np.searchsorted(codes[self.order], np.arange(n_values + 1))
+
+    def positions(self, code):
+        return self.order[self.offsets[code] : self.offsets[code + 1]]
+
+    def size(self, code):
+        return self.offsets[code + 1] - self.offsets[code]
+
+
+class PlayerStore:
+    """Every season's player rows loaded once, sorted by year and week and indexed
+
+    Filters on year (and week) are binary searches over the sorted rows, and filters on
+    week, owner, player_id, slot_position and player_position read a posting list. Several
+    filters start from the smallest candidate set and only check those rows, so no query
+    scans the whole table. Aggregations run over the matching rows with numpy.
+    """
+
+    def __init__(self, player_data):
+        df = compact_frame(player_data, PLAYER_STRING_COLS)
+        df["week"] = df["week"].astype("int8")
+        df["player_id"] = df["player_id"].astype("int32")
+        self.df = df.sort_values(SORT_COLS, kind="stable").reset_index(drop=True)
+
+        self._years = self.df["year"].to_numpy()
+        self._year_weeks = self._years.astype(np.int32) * 100 + self.df["week"].to_numpy()
+        self._values = {col: self.df[col].to_numpy(dtype=float) for col in VALUE_COLS}
+
+        # Integer codes and labels for every column that can be filtered or grouped on
+        self._codes = {}
+        self._labels = {}
+        for col in self.df.columns:
+            if isinstance(self.df[col].dtype, pd.CategoricalDtype):
+                self._codes[col] = self.df[col].cat.codes.to_numpy().astype(np.int32)
+                self._labels[col] = np.asarray(self.df[col].cat.categories)
+            elif col not in VALUE_COLS:
+                labels, codes = np.unique(self.df[col].to_numpy(), return_inverse=True)
+                self._codes[col] = codes.astype(np.int32)
+                self._labels[col] = labels
+        self._lookup = {
+            col: {label: code for code, label in enumerate(labels)}
+            for col, labels in self._labels.items()
+        }
+        self._indexes = {
+            col: PostingIndex(self._codes[col], len(self._labels[col])) for col in INDEX_COLS
+        }
+
+    @classmethod
+    def from_csv(cls, path=PLAYER_HISTORY_PATH):
+        return cls(pd.read_csv(path))
+
+    @classmethod
+    def from_parquet(cls, root="fantasy/parquet/player", filesystem=None):
+        return cls(read_player_data(root, filesystem=filesystem))
+
+    def __len__(self):
+        return len(self.df)
+
+    def rows(self, year=None, **filters):
+        """Positions of the rows matching every filter, e.g. rows(year=2020, owner="Jon Samos")"""
+        positions = None
+        if year is not None:
+            if "week" in filters:
+                key = year * 100 + filters.pop("week")
+                bounds = np.searchsorted(self._year_weeks, [key, key + 1])
+            else:
+                bounds = np.searchsorted(self._years, [year, year + 1])
+            positions = np.arange(*bounds, dtype=np.int32)
+
+        codes = {}
+        for col, value in filters.items():
+            if col not in self._lookup:
+                raise KeyError(f"Cannot filter on {col}")
+            if value not in self._lookup[col]:
+                return np.empty(0, dtype=np.int32)
+            codes[col] = self._lookup[col][value]
+
+        # Start from the shortest posting list, then check the remaining filters on those rows
+        for col in sorted(codes, key=lambda col: self._list_size(col, codes[col])):
+            if positions is None and col in self._indexes:
+                positions = self._indexes[col].positions(codes[col])
+            else:
+                if positions is None:
+                    positions = np.arange(len(self.df), dtype=np.int32)
+                positions = positions[self._codes[col][positions] == codes[col]]
+        return positions if positions is not None else np.arange(len(self.df), dtype=np.int32)
+
+    def _list_size(self, col, code):
+        return self._indexes[col].size(code) if col in self._indexes else len(self.df)
+
+    def select(self, columns=None, **filters):
+        """The matching rows as a DataFrame"""
+        selected = self.df.iloc[self.rows(**filters)]
+        return selected[columns] if columns is not None else selected
+
+    @traced()
+    def aggregate(self, by, value="points", how="sum", n=None, **filters):
+        """Sum, mean or count of value over the matching rows, grouped by one or more columns
+
+        With n, only the n largest groups are returned, largest first.
+        """
+        by = [by] if isinstance(by, str) else list(by)
+        positions = self.rows(**filters)
+        group_codes = [self._codes[col][positions] for col in by]
+        shape = [len(self._labels[col]) for col in by]
+        if len(positions):
+            combined = np.ravel_multi_index(group_codes, shape)
+        else:
+            combined = np.empty(0, dtype=np.int64)
+        groups, inverse = np.unique(combined, return_inverse=True)
+
+        counts = np.bincount(inverse, minlength=len(groups))
+        if how == "count":
+            result = counts
+        elif how in ("sum", "mean"):
+            result = np.bincount(
+                inverse, weights=self._values[value][positions], minlength=len(groups)
+            )
+            if how == "mean":
+                result = result / counts
+        else:
+            raise ValueError(f"how must be sum, mean or count, not {how}")
+
+        order = np.argsort(-result, kind="stable")[:n] if n is not None else slice(None)
+        group_keys = np.unravel_index(groups[order], shape)
+        table = {col: self._labels[col][keys] for col, keys in zip(by, group_keys)}
+        table[value if how != "count" else "count"] = result[order]
+        return pd.DataFrame(table)
+
+    def most_rostered(self, n=10, **filters):
+        """Players with the most team-weeks on a roster, per owner"""
+        return self.aggregate(["player_name", "owner"], how="count", n=n, **filters)
+
+    def position_means(self, **filters):
+        """Mean points per year and player position"""
+        return self.aggregate(["year", "player_position"], how="mean", **filters)
+
+    def slot_totals(self, **filters):
+        """Total points per lineup slot"""
+        return self.aggregate("slot_position", how="sum", **filters)
+
+    def player_history(self, player_id):
+        """Every week a player was on a roster, in date order"""
+        return self.select(player_id=player_id)
+
+
+if __name__ == "__main__":
+    player_data = pd.read_csv(PLAYER_HISTORY_PATH)
+    start = time.perf_counter()
+    store = PlayerStore(player_data)
+    print(f"Loaded {len(store)} rows in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    owner = store.df["owner"].iloc[0]
+    queries = {
+        "most rostered by owner": lambda: store.most_rostered(owner=owner),
+        "position means 2021": lambda: store.position_means(year=2021),
+        "slot totals for a week": lambda: store.slot_totals(year=2020, week=5),
+        "owner RB points by year": lambda: store.aggregate("year", owner=owner, slot_position="RB"),
+    }
+    for label, query in queries.items():
+        repeats = 200
+        start = time.perf_counter()
+        for _ in range(repeats):
+            query()
+        print(f"{label:>26}: {(time.perf_counter() - start) / repeats * 1e6:.0f} us")
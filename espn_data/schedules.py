@@ -0,0 +1,137 @@
+import numpy as np
+
+from .tracing import traced
+
+RECORD_COLS = ["wins", "losses", "ties"]
+
+
+def season_arrays(team_weeks):
+    """Points, opponents and played weeks as (seasons, teams, weeks) arrays, with the labels
+
+    Teams are sorted by name within each season. Seasons with fewer teams or weeks are
+    padded, and padded cells are marked as not played with the team as its own opponent.
+    """
+    games = team_weeks[["year", "week", "team_name", "opponent", "points"]].astype(
+        {"team_name": str, "opponent": str}
+    )
+    teams = games[["year", "team_name"]].drop_duplicates().sort_values(["year", "team_name"])
+    teams["team"] = teams.groupby("year").cumcount()
+    weeks = games[["year", "week"]].drop_duplicates().sort_values(["year", "week"])
+    weeks["week_index"] = weeks.groupby("year").cumcount()
+    years = np.sort(games["year"].unique())
+
+    games = (
+        games.merge(teams, on=["year", "team_name"])
+        .merge(
+            teams.rename(columns={"team_name": "opponent", "team": "opponent_team"}),
+            on=["year", "opponent"],
+        )
+        .merge(weeks, on=["year", "week"])
+    )
+    season = np.searchsorted(years, games["year"].to_numpy())
+    cell = (season, games["team"].to_numpy(), games["week_index"].to_numpy())
+
+    shape = (len(years), teams["team"].max() + 1, weeks["week_index"].max() + 1)
+    points = np.full(shape, np.nan)
+    points[cell] = games["points"].to_numpy(dtype=float)
+    opponents = np.broadcast_to(np.arange(shape[1])[None, :, None], shape).copy()
+    opponents[cell] = games["opponent_team"].to_numpy()
+    played = np.zeros(shape, dtype=bool)
+    played[cell] = True
+    return points, opponents, played, years, teams
+
+
+def record_counts(own, other, valid, axis):
+    """Wins, losses and ties of own against other over the valid games, summed along axis"""
+    wins = (valid & (own > other)).sum(axis=axis)
+    ties = (valid & (own == other)).sum(axis=axis)
+    return wins, valid.sum(axis=axis) - wins - ties, ties
+
+
+def schedule_swap_counts(points, opponents, played):
+    """Record of every team i playing team j's schedule, as (seasons, teams, teams) arrays
+
+    In the weeks j played i, i plays j instead, the usual rule for swapped schedules. The
+    diagonal is every team's actual record.
+    """
+    n_seasons, n_teams, n_weeks = points.shape
+    teams = np.arange(n_teams)
+
+    # Opponent of team i on team j's schedule, for every season, i, j and week
+    swapped = np.broadcast_to(opponents[:, None], (n_seasons, n_teams, n_teams, n_weeks))
+    swapped = np.where(swapped == teams[None, :, None, None], teams[None, None, :, None], swapped)
+    other = points[np.arange(n_seasons)[:, None, None, None], swapped, np.arange(n_weeks)]
+    valid = played[:, :, None, :] & played[:, None, :, :]
+    return record_counts(points[:, :, None, :], other, valid, axis=-1)
+
+
+def all_play_counts(points, played):
+    """Record of every team against every other team every week, as (seasons, teams) arrays"""
+    n_teams = points.shape[1]
+    valid = played[:, :, None, :] & played[:, None, :, :]
+    valid &= ~np.eye(n_teams, dtype=bool)[None, :, :, None]
+    return record_counts(points[:, :, None, :], points[:, None, :, :], valid, axis=(2, 3))
+
+
+@traced()
+def schedule_swap_table(team_weeks):
+    """Each team's wins, losses and ties under every other team's schedule of the same season
+
+    One row per season, team and schedule_of, the team whose schedule was played. Works on
+    one season or on several concatenated team-week tables.
+    """
+    points, opponents, played, years, teams = season_arrays(team_weeks)
+    counts = schedule_swap_counts(points, opponents, played)
+
+    pairs = teams.merge(teams.rename(columns={"team_name": "schedule_of", "team": "schedule"}))
+    index = (
+        np.searchsorted(years, pairs["year"].to_numpy()),
+        pairs["team"].to_numpy(),
+        pairs["schedule"].to_numpy(),
+    )
+    table = pairs[["year", "team_name", "schedule_of"]].reset_index(drop=True)
+    for col, count in zip(RECORD_COLS, counts):
+        table[col] = count[index]
+    return table.sort_values(["year", "team_name", "schedule_of"], ignore_index=True)
+
+
+@traced()
+def all_play_table(team_weeks):
+    """Actual and all-play records per season and team, with the wins expected from all-play
+
+    expected_wins is the all-play win rate times the games played, so schedule_luck above
+    zero means the schedule gave a team more wins than its scores earned.
+    """
+    points, opponents, played, years, teams = season_arrays(team_weeks)
+    actual = [
+        np.diagonal(count, axis1=1, axis2=2)
+        for count in schedule_swap_counts(points, opponents, played)
+    ]
+    all_play = all_play_counts(points, played)
+
+    index = (np.searchsorted(years, teams["year"].to_numpy()), teams["team"].to_numpy())
+    table = teams[["year", "team_name"]].reset_index(drop=True)
+    for col, count in zip(RECORD_COLS, actual):
+        table[col] = count[index]
+    for col, count in zip(RECORD_COLS, all_play):
+        table[f"all_play_{col}"] = count[index]
+
+    all_play_games = table[[f"all_play_{col}" for col in RECORD_COLS]].sum(axis=1)
+    table["all_play_pct"] = (table["all_play_wins"] + table["all_play_ties"] / 2) / all_play_games
+    table["expected_wins"] = table["all_play_pct"] * table[RECORD_COLS].sum(axis=1)
+    table["schedule_luck"] = table["wins"] + table["ties"] / 2 - table["expected_wins"]
+    return table.round({"all_play_pct": 3, "expected_wins": 2, "schedule_luck": 2})
+
+
+def record_matrix(swap_table, year=None):
+    """Team by schedule_of matrix of "W-L" records (with "-T" when there are ties) for a season"""
+    if year is not None:
+        swap_table = swap_table[swap_table["year"] == year]
+    records = swap_table["wins"].astype(str) + "-" + swap_table["losses"].astype(str)
+    ties = swap_table["ties"] > 0
+    records[ties] = records[ties] + "-" + swap_table["ties"][ties].astype(str)
+    return (
+        swap_table.assign(record=records)
+        .pivot(index="team_name", columns="schedule_of", values="record")
+        .rename_axis(index="Team", columns="Schedule of")
+    )
@@ -0,0 +1,103 @@
+from typing import NamedTuple
+
+import pandas as pd
+
+from .tracing import traced
+
+PERFORMER_COLS = ["team_name", "week", "name", "tp_names", "tp_points", "year"]
+
+
+class SeasonData(NamedTuple):
+    """A season as one row per team-week plus one row per top performer"""
+
+    team_weeks: pd.DataFrame
+    performers: pd.DataFrame
+
+
+def team_week_table(fantasy_data):
+    """One row per team-week, dropping the top performer columns if they are there"""
+    if "tp_names" not in fantasy_data.columns:
+        return fantasy_data
+    return (
+        fantasy_data.drop(columns=["name", "tp_names", "tp_points"])
+        .drop_duplicates(["team_name", "week"])
+        .reset_index(drop=True)
+    )
+
+
+@traced()
+def load_season(fantasy_data):
+    """Split a fantasy_data csv frame into compact, typed team-week and performer tables
+
+    Names are categories, week and year are small integers and the win columns are bools.
+    Seasons stored without top performers get an empty performer table.
+    """
+    team_weeks = team_week_table(fantasy_data).copy()
+    team_names = pd.CategoricalDtype(
+        sorted(set(team_weeks["team_name"]) | set(team_weeks["opponent"]))
+    )
+    team_weeks = team_weeks.astype(
+        {
+            "team_name": team_names,
+            "opponent": team_names,
+            "week": "int8",
+            "year": "int16",
+            "h2h_win": "bool",
+            "top6_win": "bool",
+        }
+    )
+    if "weekly_rank" not in team_weeks.columns:
+        team_weeks["weekly_rank"] = (
+            team_weeks.groupby("week")["points"].rank(method="min", ascending=False)
+        ).astype("int8")
+
+    if "tp_names" in fantasy_data.columns:
+        performers = fantasy_data[PERFORMER_COLS].reset_index(drop=True)
+    else:
+        performers = pd.DataFrame(columns=PERFORMER_COLS)
+    performers = performers.astype(
+        {
+            "team_name": team_names,
+            "week": "int8",
+            "name": "category",
+            "tp_names": "category",
+            "tp_points": "float64",
+            "year": "int16",
+        }
+    )
+    return SeasonData(team_weeks, performers)
+
+
+def complete_weeks(season):
+    """Keep only the weeks that every team has played"""
+    team_weeks, performers = season
+    week_counts = team_weeks["week"].value_counts()
+    full_weeks = week_counts[week_counts == team_weeks["team_name"].nunique()].index
+    return SeasonData(
+        team_weeks[team_weeks["week"].isin(full_weeks)],
+        performers[performers["week"].isin(full_weeks)],
+    )
+
+
+def memory_report(fantasy_data, season=None):
+    """Bytes and rows of the csv frame compared with the normalized tables"""
+    season = season if season is not None else load_season(fantasy_data)
+    frames = {
+        "fantasy_data": fantasy_data,
+        "team_weeks": season.team_weeks,
+        "performers": season.performers,
+    }
+    report = pd.DataFrame(
+        {
+            "rows": [len(df) for df in frames.values()],
+            "bytes": [int(df.memory_usage(deep=True).sum()) for df in frames.values()],
+        },
+        index=list(frames),
+    )
+    normalized_bytes = report.loc[["team_weeks", "performers"], "bytes"].sum()
+    report.loc["normalized_total"] = [
+        report.loc[["team_weeks", "performers"], "rows"].sum(),
+        normalized_bytes,
+    ]
+    report["vs_fantasy_data"] = (report["bytes"] / report.loc["fantasy_data", "bytes"]).round(3)
+    return report
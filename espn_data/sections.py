@@ -0,0 +1,65 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class SectionRegistry:
+    """Dashboard sections whose data is only computed when a section is opened
+
+    Each section has a compute function and the version of the data it reads. Results are
+    memoized per section until the version changes and are shared by every session in the
+    process. Heavy sections can be computed on a background thread before anyone opens them.
+    """
+
+    def __init__(self, max_workers=2):
+        self._sections = {}
+        self._results = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def register(self, name, compute, version, heavy=False):
+        """Add or replace a section, e.g. on every rerun of the Streamlit script"""
+        with self._lock:
+            self._sections[name] = (compute, version, heavy)
+
+    def _future(self, name, background=False):
+        """The future for the current version of a section, starting it if needed"""
+        with self._lock:
+            compute, version, _ = self._sections[name]
+            cached = self._results.get(name)
+            if cached is not None and cached[0] == version:
+                future = cached[1]
+                # Failed computations are retried instead of memoized
+                if not (future.done() and future.exception() is not None):
+                    return future
+            if background:
+                future = self._executor.submit(compute)
+                self._results[name] = (version, future)
+                return future
+            future = Future()
+            self._results[name] = (version, future)
+
+        try:
+            future.set_result(compute())
+        except Exception as error:
+            future.set_exception(error)
+        return future
+
+    def get(self, name):
+        """Data for a section, waiting for a prefetch that is already running"""
+        return self._future(name).result()
+
+    def ready(self, name):
+        with self._lock:
+            cached = self._results.get(name)
+            version = self._sections[name][1]
+        return cached is not None and cached[0] == version and cached[1].done()
+
+    def prefetch(self):
+        """Start computing every heavy section that is not memoized for its current version"""
+        with self._lock:
+            heavy = [name for name, section in self._sections.items() if section[2]]
+        for name in heavy:
+            self._future(name, background=True)
+
+
+registry = SectionRegistry()
@@ -0,0 +1,104 @@
+import glob
+import os
+
+import pandas as pd
+
+from .tracing import traced
+
+SEASON_STRING_COLS = ["team_name", "name", "tp_names", "opponent"]
+PLAYER_STRING_COLS = [
+    "player_name",
+    "slot_position",
+    "player_position",
+    "pro_team",
+    "owner",
+    "fantasy_name",
+    "opponent",
+]
+
+
+def compact_frame(df, string_cols):
+    """Drop the csv index column and store repeated strings as categories"""
+    df = df.drop(columns=[c for c in df.columns if c.startswith("Unnamed")])
+    for col in string_cols:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    for col in ["year", "week"]:
+        df[col] = df[col].astype("int16")
+    return df
+
+
+@traced()
+def write_partitioned(df, root, string_cols, filesystem=None):
+    """Write parquet partitioned by year and week, replacing partitions that already exist
+
+    Category columns are written dictionary encoded, so each name is stored once per file.
+    """
+    compact_frame(df, string_cols).to_parquet(
+        root,
+        engine="pyarrow",
+        partition_cols=["year", "week"],
+        index=False,
+        filesystem=filesystem,
+        existing_data_behavior="delete_matching",
+    )
+
+
+@traced()
+def read_partitioned(root, columns=None, year=None, week=None, filesystem=None):
+    """Read parquet written by write_partitioned
+
+    Only the requested columns are decoded and the year and week filters are applied to the
+    partition directories, so other seasons and weeks are never opened. Local files are
+    memory mapped.
+    """
+    filters = []
+    if year is not None:
+        filters.append(("year", "=", year))
+    if week is not None:
+        filters.append(("week", "=", week))
+    df = pd.read_parquet(
+        root,
+        engine="pyarrow",
+        columns=columns,
+        filters=filters or None,
+        filesystem=filesystem,
+        memory_map=filesystem is None,
+    )
+    # Partition keys come back as categories
+    for col in ["year", "week"]:
+        if col in df.columns:
+            df[col] = df[col].astype("int16")
+    return df
+
+
+def write_season_data(season_data, root="fantasy/parquet/season", filesystem=None):
+    """Write fantasy_data rows partitioned by year and week"""
+    write_partitioned(season_data, root, SEASON_STRING_COLS, filesystem=filesystem)
+
+
+def read_season_data(root="fantasy/parquet/season", **kwargs):
+    """Read fantasy_data rows, e.g. read_season_data(year=2020, columns=["team_name", "points"])"""
+    return read_partitioned(root, **kwargs)
+
+
+def write_player_data(player_data, root="fantasy/parquet/player", filesystem=None):
+    """Write full_player_data rows partitioned by year and week"""
+    write_partitioned(player_data, root, PLAYER_STRING_COLS, filesystem=filesystem)
+
+
+def read_player_data(root="fantasy/parquet/player", **kwargs):
+    """Read full_player_data rows, e.g. read_player_data(year=2019, week=3)"""
+    return read_partitioned(root, **kwargs)
+
+
+def convert_csv_history(data_dir="fantasy", root="fantasy/parquet"):
+    """Convert the csv history in fantasy/ to the partitioned parquet layout"""
+    for path in sorted(glob.glob(os.path.join(data_dir, "fantasy_data_*.csv"))):
+        write_season_data(pd.read_csv(path), os.path.join(root, "season"))
+    merged = pd.read_csv(os.path.join(data_dir, "full_player_data", "merged_full_data.csv"))
+    write_player_data(merged, os.path.join(root, "player"))
+
+
+if __name__ == "__main__":
+    convert_csv_history()
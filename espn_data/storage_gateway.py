@@ -0,0 +1,209 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .tracing import traced
+
+DEFAULT_BUCKET = "fantasy-football-palo-alto-data"
+DEFAULT_PROJECT = "fantasy-football-palo-alto"
+
+
+class GCSBackend:
+    """One authenticated storage.Client and gcsfs filesystem per bucket, created on first use"""
+
+    def __init__(self, bucket_name, credentials_info=None, project=DEFAULT_PROJECT):
+        self.name = bucket_name
+        self.project = project
+        self._credentials_info = credentials_info
+        self._credentials = None
+        self._client = None
+        self._bucket = None
+        self._filesystem = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        with self._lock:
+            if self._client is not None:
+                return
+            from google.cloud import storage
+            from google.oauth2 import service_account
+
+            info = self._credentials_info
+            info = info() if callable(info) else info
+            if info is not None:
+                self._credentials = service_account.Credentials.from_service_account_info(info)
+            self._client = storage.Client(project=self.project, credentials=self._credentials)
+            self._bucket = self._client.bucket(self.name)
+
+    @property
+    def client(self):
+        self._connect()
+        return self._client
+
+    @property
+    def bucket(self):
+        self._connect()
+        return self._bucket
+
+    @property
+    def filesystem(self):
+        """gcsfs filesystem for parquet datasets, sharing the same credentials"""
+        self._connect()
+        with self._lock:
+            if self._filesystem is None:
+                import gcsfs
+
+                token = self._credentials if self._credentials is not None else "google_default"
+                self._filesystem = gcsfs.GCSFileSystem(project=self.project, token=token)
+        return self._filesystem
+
+    def path(self, name):
+        """Path of an object for filesystem based readers and writers"""
+        return f"{self.name}/{name}"
+
+    @traced("storage.get_blob")
+    def get_blob(self, name):
+        """Blob with its generation loaded, None if it does not exist"""
+        return self.bucket.get_blob(name)
+
+    @traced("storage.list_blobs")
+    def list_blobs(self, prefix):
+        return list(self.client.list_blobs(self.bucket, prefix=prefix))
+
+    @traced("storage.exists")
+    def exists(self, name):
+        return self.bucket.blob(name).exists()
+
+    @traced("storage.read_bytes")
+    def read_bytes(self, name):
+        return self.bucket.blob(name).download_as_bytes()
+
+    @traced("storage.write_bytes")
+    def write_bytes(self, name, data, content_type=None):
+        blob = self.bucket.blob(name)
+        blob.upload_from_string(data, content_type=content_type)
+
+    @traced("storage.delete")
+    def delete(self, name):
+        self.bucket.blob(name).delete()
+
+    def download_many(self, names, max_workers=8):
+        """Download several objects in parallel, returning {name: bytes}"""
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return dict(zip(names, executor.map(self.read_bytes, names)))
+
+    def upload_many(self, objects, content_type=None, max_workers=8):
+        """Upload {name: bytes} in parallel"""
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(lambda item: self.write_bytes(*item, content_type), objects.items()))
+
+
+class LocalBlob:
+    """The parts of a GCS blob that the readers use, for a file in a LocalBackend"""
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.generation = os.stat(bucket.path(name)).st_mtime_ns
+
+    def download_as_bytes(self):
+        return self.bucket.read_bytes(self.name)
+
+
+class LocalBackend:
+    """Drop-in replacement for GCSBackend that keeps objects in a local directory
+
+    Object names map to paths under root, so parquet datasets are plain directories and no
+    credentials are needed.
+    """
+
+    filesystem = None
+
+    def __init__(self, root):
+        self.root = root
+        self.name = os.path.basename(os.path.normpath(root))
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    @traced("storage.get_blob")
+    def get_blob(self, name):
+        return LocalBlob(self, name) if os.path.isfile(self.path(name)) else None
+
+    @traced("storage.list_blobs")
+    def list_blobs(self, prefix):
+        directory = os.path.dirname(self.path(prefix))
+        blobs = []
+        for dirpath, _, filenames in os.walk(directory):
+            for filename in filenames:
+                name = os.path.relpath(os.path.join(dirpath, filename), self.root)
+                if name.startswith(prefix):
+                    blobs.append(LocalBlob(self, name))
+        return sorted(blobs, key=lambda blob: blob.name)
+
+    @traced("storage.exists")
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+    @traced("storage.read_bytes")
+    def read_bytes(self, name):
+        with open(self.path(name), "rb") as handle:
+            return handle.read()
+
+    @traced("storage.write_bytes")
+    def write_bytes(self, name, data, content_type=None):
+        os.makedirs(os.path.dirname(self.path(name)) or ".", exist_ok=True)
+        if isinstance(data, str):
+            data = data.encode()
+        with open(self.path(name), "wb") as handle:
+            handle.write(data)
+
+    @traced("storage.delete")
+    def delete(self, name):
+        os.remove(self.path(name))
+
+    def download_many(self, names, max_workers=8):
+        return {name: self.read_bytes(name) for name in names}
+
+    def upload_many(self, objects, content_type=None, max_workers=8):
+        for name, data in objects.items():
+            self.write_bytes(name, data, content_type)
+
+
+_gateways = {}
+_gateways_lock = threading.Lock()
+
+
+def get_gateway(bucket_name=DEFAULT_BUCKET, credentials_info=None):
+    """The process wide storage gateway for a bucket
+
+    Set FANTASY_STORAGE_DIR to serve every bucket from a directory of that name under it
+    instead of GCS. credentials_info is a service account dict, or a function returning one,
+    and is only used when the gateway is first created. Without it GCS uses the default
+    credentials, as in the Cloud Function.
+    """
+    local_dir = os.environ.get("FANTASY_STORAGE_DIR")
+    key = (local_dir, bucket_name)
+    with _gateways_lock:
+        if key not in _gateways:
+            if local_dir:
+                _gateways[key] = LocalBackend(os.path.join(local_dir, bucket_name))
+            else:
+                _gateways[key] = GCSBackend(bucket_name, credentials_info=credentials_info)
+        return _gateways[key]
+
+
+def streamlit_credentials_info():
+    """Service account info from fantasy_profile.json plus the key in the Streamlit secrets"""
+    import streamlit as st
+
+    with open("fantasy_profile.json", "r") as handle:
+        gcp_json_credentials_dict = json.load(handle)
+    gcp_json_credentials_dict.update(
+        {
+            "private_key": st.secrets["private_key"].replace("\\n", "\n"),
+            "private_key_id": st.secrets["private_key_id"],
+        }
+    )
+    return gcp_json_credentials_dict
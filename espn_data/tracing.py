@@ -0,0 +1,208 @@
+import contextlib
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+# active is set while tracing is enabled or any thread is collecting, so the check when
+# neither is happening stays a single lookup
+_state = {"enabled": False, "memory": False, "active": False, "collecting": 0}
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+class _ThreadState(threading.local):
+    # Totals of the spans collected for this thread only, see start_collecting
+    stats = None
+
+
+_local = _ThreadState()
+_NOOP = contextlib.nullcontext()
+
+
+def enable(memory=False):
+    """Start recording spans, and peak traced memory per span if memory is set
+
+    Memory tracking uses tracemalloc, which slows Python allocations down noticeably. Peaks
+    are process wide, so spans running in other threads count towards them.
+    """
+    _state["memory"] = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _state["enabled"] = True
+    _state["active"] = True
+
+
+def disable():
+    _state["enabled"] = False
+    _state["active"] = _state["collecting"] > 0
+    if _state["memory"] and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _state["memory"] = False
+
+
+def enabled():
+    return _state["enabled"]
+
+
+def reset():
+    with _stats_lock:
+        _stats.clear()
+
+
+def start_collecting():
+    """Record the spans of the current thread in a dict of its own, even with tracing off
+
+    Other threads are not traced and nothing is logged unless tracing is enabled, so a single
+    request can time itself without turning tracing on for the whole process. Returns the
+    dict, pass it to summary to read it.
+    """
+    with _stats_lock:
+        if _local.stats is None:
+            _state["collecting"] += 1
+        _state["active"] = True
+        _local.stats = {}
+    return _local.stats
+
+
+def stop_collecting():
+    with _stats_lock:
+        if _local.stats is not None:
+            _state["collecting"] -= 1
+        _state["active"] = _state["enabled"] or _state["collecting"] > 0
+        _local.stats = None
+
+
+def _tracing_here():
+    return _state["enabled"] or _local.stats is not None
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+class Span:
+    """Times a block, logs it as JSON and adds it to the per name totals"""
+
+    __slots__ = ("name", "fields", "start", "memory", "memory_start", "child_peak")
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        stack = _stack()
+        self.memory = _state["memory"] and tracemalloc.is_tracing()
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # Keep the enclosing span's peak before this span starts measuring its own
+            if stack and stack[-1].memory:
+                stack[-1].child_peak = max(stack[-1].child_peak, peak)
+            tracemalloc.reset_peak()
+            self.memory_start = self.child_peak = current
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        seconds = time.perf_counter() - self.start
+        stack = _stack()
+        stack.pop()
+        peak_bytes = None
+        if self.memory and tracemalloc.is_tracing():
+            peak = max(tracemalloc.get_traced_memory()[1], self.child_peak)
+            peak_bytes = peak - self.memory_start
+            if stack and stack[-1].memory:
+                stack[-1].child_peak = max(stack[-1].child_peak, peak)
+
+        if _local.stats is not None:
+            _add_stats(_local.stats, self.name, seconds, exc_type, peak_bytes)
+        if not _state["enabled"]:
+            return False
+        with _stats_lock:
+            _add_stats(_stats, self.name, seconds, exc_type, peak_bytes)
+
+        record = {"span": self.name, "seconds": round(seconds, 6), "depth": len(stack)}
+        if peak_bytes is not None:
+            record["peak_bytes"] = peak_bytes
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        logger.info(json.dumps(dict(record, **self.fields), default=str))
+        return False
+
+
+def _add_stats(totals, name, seconds, exc_type, peak_bytes):
+    stats = totals.setdefault(
+        name,
+        {
+            "calls": 0,
+            "errors": 0,
+            "total_seconds": 0.0,
+            "max_seconds": 0.0,
+            "peak_bytes": 0,
+        },
+    )
+    stats["calls"] += 1
+    stats["errors"] += exc_type is not None
+    stats["total_seconds"] += seconds
+    stats["max_seconds"] = max(stats["max_seconds"], seconds)
+    if peak_bytes is not None:
+        stats["peak_bytes"] = max(stats["peak_bytes"], peak_bytes)
+
+
+def span(name, **fields):
+    """Context manager timing a block under name, extra fields are added to its log line
+
+    Does nothing unless tracing is enabled or the current thread is collecting.
+    """
+    if not _state["active"] or not _tracing_here():
+        return _NOOP
+    return Span(name, fields)
+
+
+def traced(name=None):
+    """Decorator timing every call of a function, named module.function by default"""
+
+    def decorator(function):
+        span_name = name or f"{function.__module__.rsplit('.', 1)[-1]}.{function.__name__}"
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _state["active"] or not _tracing_here():
+                return function(*args, **kwargs)
+            with Span(span_name, {}):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def summary(collected=None):
+    """Totals per span name, slowest first, of the whole process or of a start_collecting dict"""
+    if collected is not None:
+        rows = [dict(stats, name=name) for name, stats in collected.items()]
+    else:
+        with _stats_lock:
+            rows = [dict(stats, name=name) for name, stats in _stats.items()]
+    for row in rows:
+        row["mean_seconds"] = row["total_seconds"] / row["calls"]
+    return sorted(rows, key=lambda row: row["total_seconds"], reverse=True)
+
+
+def log_summary():
+    summary_rows = summary()
+    logger.info(json.dumps({"trace_summary": summary_rows}, default=str))
+    return summary_rows
+
+
+# FANTASY_TRACE=1 traces timings, FANTASY_TRACE=memory traces peak memory as well
+if os.environ.get("FANTASY_TRACE"):
+    enable(memory=os.environ["FANTASY_TRACE"] == "memory")
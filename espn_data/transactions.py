@@ -0,0 +1,199 @@
+import glob
+import itertools
+import os
+import pickle
+import re
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .tracing import span, traced
+
+TRANSACTION_COLS = ["date", "team_name", "action", "player_id", "player_name", "bid"]
+# Columns that identify a transaction, the first four values of an activity_rows tuple
+KEY_COLS = ["date", "team_name", "action", "player_id"]
+TRANSACTION_DTYPES = {
+    "date": "int64",
+    "team_name": "category",
+    "action": "category",
+    "player_id": "int64",
+    "player_name": "category",
+    "bid": "int32",
+}
+TRANSACTION_SCHEMA = pa.schema(
+    [
+        ("date", pa.int64()),
+        ("team_name", pa.string()),
+        ("action", pa.string()),
+        ("player_id", pa.int64()),
+        ("player_name", pa.string()),
+        ("bid", pa.int32()),
+    ]
+)
+
+
+def owner_name(team):
+    """First and last name of a team's first owner, as used for team_name everywhere else
+
+    Older espn_api versions stored the owner's name as a string on team.owner.
+    """
+    if hasattr(team, "owners"):
+        return team.owners[0]["firstName"] + " " + team.owners[0]["lastName"]
+    return team.owner
+
+
+def activity_rows(activities):
+    """Flatten espn_api Activity objects into one tuple per action"""
+    for activity in activities:
+        for step in activity.actions:
+            team, action, player = step[0], step[1], step[2]
+            bid = step[3] if len(step) > 3 else 0
+            yield (
+                activity.date,
+                owner_name(team),
+                action,
+                player.playerId,
+                player.name,
+                bid,
+            )
+
+
+def transactions_frame(rows):
+    """Typed transaction table from activity_rows, newest first as ESPN returns them
+
+    date is the ESPN timestamp in milliseconds, names and actions are categories.
+    """
+    transactions = pd.DataFrame(list(rows), columns=TRANSACTION_COLS)
+    return transactions.astype(TRANSACTION_DTYPES)
+
+
+def iter_activities(league, since=None, page_size=25):
+    """Page through league activity newest first, stopping at the first one before since
+
+    Activities at since itself are included: ESPN gives a whole waiver run one timestamp, so
+    a store whose newest date is since may hold only part of that run.
+    """
+    offset = 0
+    while True:
+        with span("espn.recent_activity", offset=offset):
+            page = league.recent_activity(size=page_size, offset=offset)
+        for activity in page:
+            if since is not None and activity.date < since:
+                return
+            yield activity
+        if len(page) < page_size:
+            return
+        offset += page_size
+
+
+def free_part_path(store, date, filesystem=None):
+    """part-{date}.parquet, or part-{date}-{n}.parquet if a part already has that name"""
+    exists = os.path.exists if filesystem is None else filesystem.exists
+    part_path = f"{store}/part-{date}.parquet"
+    n = 0
+    while exists(part_path):
+        n += 1
+        part_path = f"{store}/part-{date}-{n}.parquet"
+    return part_path
+
+
+@traced()
+def write_transaction_rows(rows, store, filesystem=None, chunk_size=500):
+    """Stream activity_rows into a new part file of a transaction store
+
+    Rows are written one chunk at a time so memory does not grow with the history. The part
+    is named after its newest transaction date and nothing is written when there are no
+    rows. Returns the number of rows written.
+    """
+    writer = None
+    written = 0
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            break
+        table = pa.Table.from_pandas(
+            pd.DataFrame(chunk, columns=TRANSACTION_COLS), schema=TRANSACTION_SCHEMA
+        )
+        if writer is None:
+            if filesystem is None:
+                os.makedirs(store, exist_ok=True)
+            part_path = free_part_path(store, chunk[0][0], filesystem=filesystem)
+            writer = pq.ParquetWriter(part_path, TRANSACTION_SCHEMA, filesystem=filesystem)
+        writer.write_table(table)
+        written += len(chunk)
+    if writer is not None:
+        writer.close()
+    return written
+
+
+@traced()
+def read_transactions(store, columns=None, actions=None, filesystem=None):
+    """Load a transaction store, optionally only some columns and some actions
+
+    The action filter is pushed down to the parquet row groups.
+    """
+    columns = list(columns) if columns is not None else None
+    filters = [("action", "in", list(actions))] if actions is not None else None
+    transactions = pd.read_parquet(
+        store, engine="pyarrow", columns=columns, filters=filters, filesystem=filesystem
+    )
+    return transactions.astype(
+        {col: dtype for col, dtype in TRANSACTION_DTYPES.items() if col in transactions.columns}
+    )
+
+
+def latest_transaction_date(store, filesystem=None):
+    """Newest stored transaction date, None for an empty store"""
+    exists = os.path.exists(store) if filesystem is None else filesystem.exists(store)
+    if not exists:
+        return None
+    dates = read_transactions(store, columns=["date"], filesystem=filesystem).date
+    return int(dates.max()) if len(dates) else None
+
+
+def stored_keys(store, since, filesystem=None):
+    """KEY_COLS tuples of the stored transactions at or after since"""
+    stored = read_transactions(store, columns=KEY_COLS, filesystem=filesystem)
+    stored = stored[stored["date"] >= since].astype({"team_name": str, "action": str})
+    return set(stored.itertuples(index=False, name=None))
+
+
+@traced()
+def sync_transactions(league, store, filesystem=None, page_size=25):
+    """Append the league activity that is not in the store yet and return the new row count
+
+    Activity from the newest stored timestamp on is fetched again, and the rows already
+    stored are skipped.
+    """
+    since = latest_transaction_date(store, filesystem=filesystem)
+    rows = activity_rows(iter_activities(league, since=since, page_size=page_size))
+    if since is not None:
+        seen = stored_keys(store, since, filesystem=filesystem)
+        rows = (row for row in rows if row[:4] not in seen)
+    return write_transaction_rows(rows, store, filesystem=filesystem)
+
+
+def convert_pickles(patterns=("wd_*.pickle", "fantasy/waiver_data/wd_*.pickle")):
+    """One time conversion of pickled recent_activity lists to wd_{year} transaction stores
+
+    Each store is written next to its pickle. Returns the stores that were written.
+    """
+    written = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            if not re.search(r"wd_\d{4}\.pickle$", path):
+                continue
+            with open(path, "rb") as handle:
+                activities = pickle.load(handle)
+            store = os.path.splitext(path)[0]
+            write_transaction_rows(activity_rows(activities), store)
+            written.append(store)
+    return written
+
+
+if __name__ == "__main__":
+    for store in convert_pickles():
+        size = sum(os.path.getsize(path) for path in glob.glob(f"{store}/*.parquet"))
+        print(f"Wrote {store} ({size / 1024:.0f} KB)")
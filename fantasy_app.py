@@ -2,15 +2,28 @@ import streamlit as st
 import pandas as pd
 import altair as alt
 from espn_api.football import League
-from espn_data.get_espn_data import get_season_data
-import espn_data.ff_probability as ff_probability
+from espn_data.counterfactuals import counterfactual_summary, flip_rates, slot_counterfactuals
+from espn_data.analytics import (
+    build_analytics,
+    has_complete_weeks,
+    load_manifest,
+    load_table,
+    write_analytics,
+)
+from espn_data.get_espn_data import box_score_cache, get_season_data, last_completed_week
 import espn_data.build_tables as build_tables
+import espn_data.ff_probability as ff_probability
+import espn_data.schedules as schedules
+import espn_data.schema as schema
+import espn_data.tracing as tracing
+from espn_data.gcs_cache import blob_cache
+from espn_data.player_store import PLAYER_HISTORY_PATH, PlayerStore
+from espn_data.sections import registry
+from espn_data.storage_gateway import get_gateway, streamlit_credentials_info
 import numpy as np
-from google.cloud import storage
-from google.oauth2 import service_account
-import json
 import io
 import hashlib
+import os
 
 st.set_page_config(
     layout="wide",
@@ -34,6 +47,13 @@ st.markdown(
     "**Each week, two points are awarded** — one for winning your matchup and one for placing Top 6 in points scored."
 )
 
+# ?debug=1 adds a table of how long each step of the page took. Only this run's thread is
+# traced, other sessions and the process-wide tracing are left alone. Streamlit reruns in the
+# same thread after interrupting a run, so first stop what an interrupted run collected.
+debug_timings = "debug" in st.query_params
+tracing.stop_collecting()
+debug_stats = tracing.start_collecting() if debug_timings else None
+
 # Season Selection
 year_selection = 2025
 year = year_selection
@@ -44,24 +64,22 @@ st.header(f"{year_selection} Regular Season Summary")
 # Read in data helper functions
 def push_pull_from_gcs(
     year: int,
-    gcp_json_credentials_dict: dict,
     bucket_name: str,
     pull=True,
     upload_file=None,
     push=False,
 ) -> pd.DataFrame:
     """Push or pull the weekly top scores data from GCS. Either put it up or pull it down."""
-    credentials = service_account.Credentials.from_service_account_info(gcp_json_credentials_dict)
-    client = storage.Client(credentials=credentials)
-    bucket = client.bucket(bucket_name)
+    gateway = get_gateway(bucket_name, credentials_info=streamlit_credentials_info)
     source_file_name = f"fantasy_data_{year}.csv"
-    blob = bucket.blob(source_file_name)
     if pull:
-        data = blob.download_as_string()
-        df = pd.read_csv(io.BytesIO(data))
+        df = blob_cache.get(
+            gateway, source_file_name, parse=lambda data: pd.read_csv(io.BytesIO(data))
+        )
         return df
     elif push:
-        blob.upload_from_string(upload_file.to_csv(index=False), "text/csv")
+        gateway.write_bytes(source_file_name, upload_file.to_csv(index=False), "text/csv")
+        blob_cache.invalidate(gateway.name, source_file_name)
         return upload_file
 
 
@@ -70,14 +88,6 @@ def get_fantasy_data(
     season: int, refresh=False, bucket_name="fantasy-football-palo-alto-data"
 ) -> pd.DataFrame:
     """Get the data from the GCS bucket. Refresh if given the arg"""
-    # Try to get the data from the bucket
-    gcp_json_credentials_dict = json.load(open("fantasy_profile.json", "r"))
-    gcp_json_credentials_dict.update(
-        {
-            "private_key": st.secrets["private_key"].replace("\\n", "\n"),
-            "private_key_id": st.secrets["private_key_id"],
-        }
-    )
     if refresh:
         league = League(
             league_id=443750, year=season, espn_s2=st.secrets["espn_s2"], swid=st.secrets["swid"]
@@ -85,34 +95,112 @@ def get_fantasy_data(
         all_data = get_season_data(season, league)
         df = push_pull_from_gcs(
             season,
-            gcp_json_credentials_dict,
             bucket_name,
             upload_file=all_data,
             pull=False,
             push=True,
         )
+        # There is nothing to precompute until every team has finished a week
+        if has_complete_weeks(all_data):
+            gateway = get_gateway(bucket_name, credentials_info=streamlit_credentials_info)
+            analytics = build_analytics(all_data, league, seed=season)
+            write_analytics(analytics, gateway, season, last_completed_week(all_data, league))
+            blob_cache.invalidate(gateway.name, f"analytics/{season}/")
     else:
-        df = push_pull_from_gcs(season, gcp_json_credentials_dict, bucket_name, pull=True)
+        df = push_pull_from_gcs(season, bucket_name, pull=True)
     return df
 
 
 # Read in the data
-fantasy_data = get_fantasy_data(year_selection, refresh=False)
-# If not everyone has played, remove the week
-week_counts = fantasy_data["week"].value_counts()
-week_counts = week_counts[week_counts == 12 * 3]
-fantasy_data = fantasy_data[fantasy_data.week.isin(week_counts.index)]
-
-our_league = League(
-    league_id=st.secrets["league_id"],
-    year=year_selection,
-    espn_s2=st.secrets["espn_s2"],
-    swid=st.secrets["swid"],
+with tracing.span("app.load_data"):
+    fantasy_data = get_fantasy_data(year_selection, refresh=False)
+    # If not everyone has played, remove the week
+    season = schema.complete_weeks(schema.load_season(fantasy_data))
+    fantasy_points = season.team_weeks
+
+# The tables are precomputed by the weekly Cloud Function, build them here only if it has not
+# run for this season yet
+gateway = get_gateway(credentials_info=streamlit_credentials_info)
+manifest = load_manifest(gateway, year_selection)
+if manifest is not None:
+    data_version = manifest["built_at"]
+else:
+    data_version = hashlib.sha1(pd.util.hash_pandas_object(fantasy_data).values).hexdigest()
+
+
+def analytics_table(name, build):
+    """A stored analytics table, or build it if the season has no stored tables"""
+    table = load_table(gateway, manifest, name) if manifest is not None else None
+    return table if table is not None else build()
+
+
+def get_league():
+    return League(
+        league_id=st.secrets["league_id"],
+        year=year_selection,
+        espn_s2=st.secrets["espn_s2"],
+        swid=st.secrets["swid"],
+    )
+
+
+def lazy_expander(title, name):
+    """Expander whose content is only computed once the reader switches it on"""
+    expander = st.expander(title)
+    return expander, expander.toggle("Show", key=f"show_{name}")
+
+
+# Sections outside the standings only compute when opened, heavy ones are prefetched
+registry.register(
+    "luck",
+    lambda: analytics_table(
+        "luck",
+        lambda: ff_probability.cumulative_table(
+            ff_probability.build_probability_distribution(fantasy_points, seed=year_selection)
+        ),
+    ),
+    data_version,
+    heavy=True,
+)
+registry.register(
+    "player_store",
+    PlayerStore.from_csv,
+    os.path.getmtime(PLAYER_HISTORY_PATH),
+    heavy=True,
+)
+registry.register(
+    "slot_counterfactuals",
+    lambda: counterfactual_summary(
+        slot_counterfactuals(registry.get("player_store").df), by=("owner", "slot_position")
+    ),
+    os.path.getmtime(PLAYER_HISTORY_PATH),
+    heavy=True,
+)
+registry.register(
+    "margins_waivers",
+    lambda: analytics_table(
+        "margins_waivers",
+        lambda: build_tables.calc_margins_waivers(fantasy_points, get_league()),
+    ),
+    data_version,
+    heavy=True,
+)
+
+scoreboard = {}
+
+
+def build_scoreboard():
+    """Records and top 6 pivot, built at most once per run for whichever fallback needs them"""
+    if not scoreboard:
+        scoreboard["records"], scoreboard["top6_pivot"] = build_tables.create_top6_and_record_table(
+            fantasy_points
+        )
+    return scoreboard
+
+
+records = analytics_table("records", lambda: build_scoreboard()["records"])
+t6_pivot = build_tables.style_top6_pivot(
+    analytics_table("top6_pivot", lambda: build_scoreboard()["top6_pivot"].data)
 )
-# Make a single table
-cols_remove = ["name", "tp_names", "tp_points"]
-fantasy_points = fantasy_data.drop(columns=cols_remove).drop_duplicates()
-records, t6_pivot = build_tables.create_top6_and_record_table(fantasy_data)
 
 records.index.name = "Team"
 
@@ -139,144 +227,271 @@ with st.expander("Top 6 Scores per Week", expanded=True):
 
 ## Team selection
 
-with st.expander("Matchup Luck"):
-    liklihood_table = (
-        ff_probability.build_probability_distribution(fantasy_data)
-        .sort_index(ascending=False)
-        .cumsum(axis=0)
-        .sort_index(ascending=True)
-    )
-    st.markdown("# How lucky have your matchups been?")
-    st.markdown("We simulated 10,000 seasons with a random order of Head to Head matchups")
-    st.markdown(
-        "This table shows the cumulative probability that each team will have at least X wins thus far in the season. If your true number of wins is below 50%, you are lucky. <br> <span style='color:red'>Red</span> text denotes true number of wins",
-        unsafe_allow_html=True,
-    )
-
-    # Select the liklihood wins
-    num_wins = (
-        records["Standing"].str.extract("(^\d{,2})").astype("int").reset_index()
-    )  # .reset_index()
-    num_wins.columns = ["team_name", "wins"]
-    # Issue with the column names in the num wins section
-    # print(num_wins)
-    num_wins = list(zip(num_wins.team_name, num_wins.wins))
-
-    # Color a cell if it the right number of wins
-    def style_specific_cell(x, wins):
-        color = "color: red"
-        df1 = pd.DataFrame("", index=x.index, columns=x.columns)
-
-        for row in wins:
-            df1.loc[row[1], row[0]] = color
-        return df1
-
-    format_dict = {col: "{:,.1%}".format for col in liklihood_table.columns}
-    formatted_liklihood = (
-        liklihood_table.style.bar(color="darkblue")
-        .format(format_dict)
-        .apply(style_specific_cell, wins=num_wins, axis=None)
-        .set_caption("Likelihood for having at least X wins so far")
-    )
-    st.table(formatted_liklihood)
-
-
-with st.expander("Margin of Victory/Loss + Waiver Points"):
-    col1_m, col2_m = st.columns(2)
-    with col1_m:
-        st.markdown("## Average margin of loss or victory")
-        st.markdown("By how much did each team win or lose?")
-        margins_wavier_pts = build_tables.calc_margins_waivers(fantasy_data, our_league)
-        st.altair_chart(build_tables.avg_margin_chart(margins_wavier_pts), use_container_width=True)
-
-    with col2_m:
-        st.markdown("## Average points from waiver pickups")
-        st.markdown("By how much did each team benefit from their additions?")
-        st.altair_chart(
-            alt.Chart(margins_wavier_pts.fillna(0))
-            .mark_bar(filled=True, color="cyan", xOffset=1)
-            .encode(
-                y=alt.Y("team_name", title="Team Name", sort="-x"),
-                x=alt.X("average_waiver_points", title="Avg. points added via waivers"),
-                tooltip=[
-                    alt.Tooltip("team_name", title="Team Name"),
-                    alt.Tooltip(
-                        "average_waiver_points", format=".2f", title="Avg. points from waivers"
-                    ),
-                ],
-            ),
-            use_container_width=True,
+luck_expander, show_luck = lazy_expander("Matchup Luck", "luck")
+if show_luck:
+    with luck_expander:
+        with tracing.span("app.section", section="luck"):
+            liklihood_table = registry.get("luck")
+        st.markdown("# How lucky have your matchups been?")
+        st.markdown("We simulated 10,000 seasons with a random order of Head to Head matchups")
+        st.markdown(
+            "This table shows the cumulative probability that each team will have at least X wins thus far in the season. If your true number of wins is below 50%, you are lucky. <br> <span style='color:red'>Red</span> text denotes true number of wins",
+            unsafe_allow_html=True,
         )
 
-with st.expander("Teams"):
-    teams = fantasy_data["team_name"].drop_duplicates().tolist()
-    teams.sort()
-    selected_team_name = st.selectbox("Select a team", teams)
-
-    # Header
-    st.header(f"Performance by: {selected_team_name}")
-
-    # Selected team
-    selected_team = fantasy_points.query("team_name == @selected_team_name")
-    selected_team["points"] = selected_team["points"].round(2)
-    selected_team["points_against"] = selected_team["points_against"].round(2)
-    max_points, min_points = selected_team["points"].max(), selected_team["points"].min()
-    avg_points = selected_team["points"].mean()
-
-    a, b, c = st.columns(3)
-
-    a.metric("Max points (up from average)", max_points, np.round(max_points - avg_points, 2))
-    b.metric("Min points (down from average)", min_points, np.round(min_points - avg_points, 2))
-    if len(selected_team.points) > 1:
-        c.metric("Standard deviation of points", round(selected_team.points.std()))
-
-    # Team Table
-    st.markdown("## Team Table")
-    st.dataframe(
-        selected_team[
-            ["week", "points", "opponent", "points_against", "h2h_win", "top6_win"]
-        ].rename(
-            columns={
-                "week": "Week",
-                "points": "Points For",
-                "opponent": "Opponent Name",
-                "points_against": "Points Against",
-                "h2h_win": "Head2Head Win",
-                "top6_win": "Top 6 Win",
-            }
+        # Select the liklihood wins
+        num_wins = (
+            records["Standing"].str.extract("(^\d{,2})").astype("int").reset_index()
+        )  # .reset_index()
+        num_wins.columns = ["team_name", "wins"]
+        # Issue with the column names in the num wins section
+        # print(num_wins)
+        num_wins = list(zip(num_wins.team_name, num_wins.wins))
+
+        # Color a cell if it the right number of wins
+        def style_specific_cell(x, wins):
+            color = "color: red"
+            df1 = pd.DataFrame("", index=x.index, columns=x.columns)
+
+            for row in wins:
+                df1.loc[row[1], row[0]] = color
+            return df1
+
+        format_dict = {col: "{:,.1%}".format for col in liklihood_table.columns}
+        formatted_liklihood = (
+            liklihood_table.style.bar(color="darkblue")
+            .format(format_dict)
+            .apply(style_specific_cell, wins=num_wins, axis=None)
+            .set_caption("Likelihood for having at least X wins so far")
         )
-    )
+        st.table(formatted_liklihood)
 
-    melted_points = selected_team[["week", "points", "points_against"]].melt(
-        id_vars=["week"], value_vars=["points", "points_against"]
-    )
 
-    team_col1, team_col2 = st.columns(2)
-    # Right column
-    with team_col1:
-        tp_df = fantasy_data.query("team_name == @selected_team_name")
-        tp_df.tp_points = [float(i) for i in tp_df.tp_points.to_list()]
-        top_scorers = tp_df.groupby("tp_names", group_keys=False).agg("count").reset_index()
-
-        top_scorers_plot = (
-            alt.Chart(top_scorers)
-            .mark_bar(size=15)
-            .encode(
-                x=alt.X(
-                    "tp_names", axis=alt.Axis(title="Player", labels=True, ticks=True), sort="-y"
+schedules_expander, show_schedules = lazy_expander("Schedule Swap and All-Play", "schedules")
+if show_schedules:
+    with schedules_expander:
+        with tracing.span("app.section", section="schedules"):
+            all_play = analytics_table("all_play", lambda: schedules.all_play_table(fantasy_points))
+            schedule_swap = analytics_table(
+                "schedule_swap", lambda: schedules.schedule_swap_table(fantasy_points)
+            )
+        st.markdown("# What if you had someone else's schedule?")
+        st.markdown(
+            "All-play counts every week as a game against every other team. Expected wins are "
+            "the all-play win rate times the games played, so a positive schedule luck means "
+            "the schedule won you more games than your scores did."
+        )
+        st.dataframe(
+            all_play.set_index("team_name")
+            .sort_values("schedule_luck", ascending=False)
+            .rename_axis("Team")[
+                ["wins", "losses", "all_play_wins", "all_play_losses", "all_play_pct"]
+                + ["expected_wins", "schedule_luck"]
+            ]
+            .rename(
+                columns={
+                    "wins": "Wins",
+                    "losses": "Losses",
+                    "all_play_wins": "All-play Wins",
+                    "all_play_losses": "All-play Losses",
+                    "all_play_pct": "All-play %",
+                    "expected_wins": "Expected Wins",
+                    "schedule_luck": "Schedule Luck",
+                }
+            )
+            .style.format({"All-play %": "{:.1%}", "Expected Wins": "{:.2f}"})
+            .format({"Schedule Luck": "{:+.2f}"})
+        )
+        st.markdown("#### Each team's record with every other team's schedule")
+        st.markdown("Rows are the team, columns the schedule. The diagonal is the real record.")
+
+        def style_diagonal(matrix):
+            return pd.DataFrame(
+                np.where(
+                    matrix.index.to_numpy()[:, None] == matrix.columns.to_numpy(),
+                    "font-weight: bold",
+                    "",
                 ),
-                y=alt.Y(
-                    "tp_points:Q",
-                    axis=alt.Axis(title="Times a top performer"),
+                index=matrix.index,
+                columns=matrix.columns,
+            )
+
+        record_matrix = schedules.record_matrix(schedule_swap)
+        st.table(record_matrix.style.apply(style_diagonal, axis=None))
+
+
+margins_expander, show_margins = lazy_expander("Margin of Victory/Loss + Waiver Points", "margins")
+if show_margins:
+    with margins_expander:
+        col1_m, col2_m = st.columns(2)
+        with col1_m:
+            st.markdown("## Average margin of loss or victory")
+            st.markdown("By how much did each team win or lose?")
+            with tracing.span("app.section", section="margins_waivers"):
+                margins_wavier_pts = registry.get("margins_waivers")
+            st.altair_chart(
+                build_tables.avg_margin_chart(margins_wavier_pts), use_container_width=True
+            )
+
+        with col2_m:
+            st.markdown("## Average points from waiver pickups")
+            st.markdown("By how much did each team benefit from their additions?")
+            st.altair_chart(
+                alt.Chart(margins_wavier_pts.fillna(0))
+                .mark_bar(filled=True, color="cyan", xOffset=1)
+                .encode(
+                    y=alt.Y("team_name", title="Team Name", sort="-x"),
+                    x=alt.X("average_waiver_points", title="Avg. points added via waivers"),
+                    tooltip=[
+                        alt.Tooltip("team_name", title="Team Name"),
+                        alt.Tooltip(
+                            "average_waiver_points", format=".2f", title="Avg. points from waivers"
+                        ),
+                    ],
                 ),
+                use_container_width=True,
             )
-            .properties(width=400, height=400)
+
+teams_expander, show_teams = lazy_expander("Teams", "teams")
+if show_teams:
+    with teams_expander:
+        teams = fantasy_points["team_name"].drop_duplicates().astype(str).tolist()
+        teams.sort()
+        selected_team_name = st.selectbox("Select a team", teams)
+
+        # Header
+        st.header(f"Performance by: {selected_team_name}")
+
+        # Selected team
+        selected_team = fantasy_points.query("team_name == @selected_team_name")
+        selected_team["points"] = selected_team["points"].round(2)
+        selected_team["points_against"] = selected_team["points_against"].round(2)
+        max_points, min_points = selected_team["points"].max(), selected_team["points"].min()
+        avg_points = selected_team["points"].mean()
+
+        a, b, c = st.columns(3)
+
+        a.metric("Max points (up from average)", max_points, np.round(max_points - avg_points, 2))
+        b.metric("Min points (down from average)", min_points, np.round(min_points - avg_points, 2))
+        if len(selected_team.points) > 1:
+            c.metric("Standard deviation of points", round(selected_team.points.std()))
+
+        # Team Table
+        st.markdown("## Team Table")
+        st.dataframe(
+            selected_team[
+                ["week", "points", "opponent", "points_against", "h2h_win", "top6_win"]
+            ].rename(
+                columns={
+                    "week": "Week",
+                    "points": "Points For",
+                    "opponent": "Opponent Name",
+                    "points_against": "Points Against",
+                    "h2h_win": "Head2Head Win",
+                    "top6_win": "Top 6 Win",
+                }
+            )
+        )
+
+        melted_points = selected_team[["week", "points", "points_against"]].melt(
+            id_vars=["week"], value_vars=["points", "points_against"]
         )
 
-        st.markdown("## Top performers")
-        st.markdown("#### How many times each player was in the top 3 performers on the team")
+        team_col1, team_col2 = st.columns(2)
+        # Right column
+        with team_col1:
+            tp_df = season.performers.query("team_name == @selected_team_name")
+            top_scorers = (
+                tp_df.groupby("tp_names", group_keys=False, observed=True)
+                .agg("count")
+                .reset_index()
+            )
 
-        st.altair_chart(top_scorers_plot)
+            top_scorers_plot = (
+                alt.Chart(top_scorers)
+                .mark_bar(size=15)
+                .encode(
+                    x=alt.X(
+                        "tp_names",
+                        axis=alt.Axis(title="Player", labels=True, ticks=True),
+                        sort="-y",
+                    ),
+                    y=alt.Y(
+                        "tp_points:Q",
+                        axis=alt.Axis(title="Times a top performer"),
+                    ),
+                )
+                .properties(width=400, height=400)
+            )
+
+            st.markdown("## Top performers")
+            st.markdown("#### How many times each player was in the top 3 performers on the team")
+
+            st.altair_chart(top_scorers_plot)
+
+players_expander, show_players = lazy_expander("All-time Players", "players")
+if show_players:
+    with players_expander:
+        with tracing.span("app.section", section="player_store"):
+            player_store = registry.get("player_store")
+        owners = sorted(player_store.df["owner"].cat.categories)
+        selected_owner = st.selectbox("Select an owner", owners)
+
+        players_col1, players_col2 = st.columns(2)
+        with players_col1:
+            st.markdown("## Most rostered players")
+            st.markdown("Team-weeks on the roster across every stored season")
+            st.dataframe(
+                player_store.most_rostered(n=15, owner=selected_owner)
+                .drop(columns="owner")
+                .rename(columns={"player_name": "Player", "count": "Weeks Rostered"}),
+                hide_index=True,
+            )
+        with players_col2:
+            st.markdown("## Points by lineup slot")
+            st.markdown("Average points each starting slot scored for this owner")
+            slot_means = player_store.aggregate("slot_position", how="mean", owner=selected_owner)
+            st.dataframe(
+                slot_means[~slot_means.slot_position.isin(["BE", "IR"])]
+                .round(2)
+                .rename(columns={"slot_position": "Slot", "points": "Avg. Points"}),
+                hide_index=True,
+            )
+
+slots_expander, show_slots = lazy_expander("What If: Lineup Slots", "slots")
+if show_slots:
+    with slots_expander:
+        with tracing.span("app.section", section="slot_counterfactuals"):
+            slot_summary = registry.get("slot_counterfactuals")
+        st.markdown("## Would you have won without your QB?")
+        st.markdown(
+            "Every matchup of every stored season replayed with one starting slot changed: "
+            "your slot scoring zero, the slot scoring zero for both teams, or the two teams "
+            "trading the slot's points."
+        )
+        slots_col1, slots_col2 = st.columns(2)
+        with slots_col1:
+            st.markdown("#### Share of matchups whose result flips")
+            st.dataframe(
+                flip_rates(slot_summary)
+                .set_index("slot_position")
+                .rename_axis("Slot")
+                .rename(
+                    columns={
+                        "without_slot": "Your slot scores 0",
+                        "without_both_slots": "Both slots score 0",
+                        "swapped_slot": "Slots swapped",
+                    }
+                )
+                .style.format("{:.1%}")
+            )
+        with slots_col2:
+            st.markdown("#### Wins each slot was needed for")
+            st.dataframe(
+                slot_summary.pivot(
+                    index="owner", columns="slot_position", values="wins_lost_without_slot"
+                ).rename_axis(index="Owner", columns="Slot")
+            )
 
 with st.expander("Refresh Data"):
     with st.form("refresh"):
@@ -291,3 +506,15 @@ with st.expander("Refresh Data"):
         elif refresh_password:
             st.error("Wrong Password")
         st.form_submit_button("Submit")
+
+if debug_timings:
+    tracing.stop_collecting()
+    with st.expander("Debug: timings", expanded=True):
+        st.markdown("Every traced call made while this page was drawing")
+        st.dataframe(pd.DataFrame(tracing.summary(debug_stats)).set_index("name"))
+        st.markdown("Cache counters since the app started")
+        for label, cache in [("GCS blobs", blob_cache), ("ESPN box scores", box_score_cache)]:
+            st.dataframe(pd.DataFrame([cache.stats()], index=[label]))
+
+# Compute the heavy sections in the background now that the page has been drawn
+registry.prefetch()
@@ -1,56 +1,193 @@
 from espn_api.football import League
-import pickle
-import streamlit as st
-from espn_data.get_espn_data import get_season_data
-from google.cloud import storage
+from espn_data.analytics import build_analytics, has_complete_weeks, write_analytics
+from espn_data.get_espn_data import get_season_data, last_completed_week
+from espn_data.storage import write_season_data
+from espn_data.storage_gateway import get_gateway
+from espn_data import tracing
+from espn_data.transactions import read_transactions, sync_transactions, transactions_frame
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
-import gcsfs
+import argparse
 import logging
 import os
+import io
+import time
 
 # Only need this if you're running this code locally.
 # os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = r"/your_GCP_creds/credentials.json"
 
+BUCKET_NAME = "fantasy-football-palo-alto-data"
+CURRENT_SEASON = 2025
 
-def save_season_data(request):
-    """Save the data for 2021 on GCP"""
-
-    for year in [2025]:
-        BUCKET_NAME = "fantasy-football-palo-alto-data"
-        PROJECT_NAME = "fantasy-football-palo-alto"
-
-        # Initalize league
-        our_league = League(
-            league_id=os.environ.get("league_id"),
-            year=year,
-            espn_s2=os.environ.get("espn_s2"),
-            swid=os.environ.get("swid"),
-        )
-        logging.info("League connected")
 
-        # Download data
-        season_data_2021 = get_season_data(year, our_league)
-        logging.info("Data downloaded")
+def connect_league(year):
+    """Initalize the league for a season"""
+    return League(
+        league_id=os.environ.get("league_id"),
+        year=year,
+        espn_s2=os.environ.get("espn_s2"),
+        swid=os.environ.get("swid"),
+    )
 
-        # Connect to the client
-        client = storage.Client()
-        bucket = client.get_bucket(BUCKET_NAME)
 
-        # Save the data
-        bucket.blob(f"fantasy_data_{year}.csv").upload_from_string(
-            season_data_2021.to_csv(index=False), "text/csv"
-        )
-        logging.info("Data saved to GCS")
+def checkpoint_name(year, week):
+    return f"checkpoints/{year}/week_{week:02d}.csv"
+
+
+def load_checkpoints(gateway, year):
+    """The weeks of a season saved by a run that did not finish, None if there are none"""
+    names = [blob.name for blob in gateway.list_blobs(f"checkpoints/{year}/")]
+    if not names:
+        return None
+    weeks = gateway.download_many(names)
+    return pd.concat([pd.read_csv(io.BytesIO(weeks[name])) for name in names])
+
+
+def resume_point(existing, checkpoints):
+    """The stored season with any checkpointed weeks replacing or extending it"""
+    if checkpoints is None:
+        return existing
+    if existing is None:
+        return checkpoints
+    return pd.concat([existing[~existing.week.isin(checkpoints.week)], checkpoints])
+
+
+@tracing.traced()
+def save_year(gateway, year, full_refetch=False, max_workers=1):
+    """Download a season and save the csv, parquet, transactions and analytics
+
+    Every week is checkpointed as soon as it is downloaded, so a run that is stopped part way
+    starts again after the last checkpointed week. Returns the time spent in each step.
+    """
+    timings = {"year": year}
+    start = time.perf_counter()
+    our_league = connect_league(year)
+    logging.info(f"{year}: League connected")
+
+    season_name = f"fantasy_data_{year}.csv"
+
+    # Only fetch the weeks after the stored watermark unless a full refetch is requested
+    existing = None
+    if not full_refetch and gateway.exists(season_name):
+        existing = pd.read_csv(io.BytesIO(gateway.read_bytes(season_name)))
+    existing = resume_point(existing, load_checkpoints(gateway, year))
+    watermark = last_completed_week(existing, our_league)
+    timings["resumed_after_week"] = watermark
+    logging.info(f"{year}: Stored data complete through week {watermark}")
+
+    # Download data
+    def checkpoint(week, weekly_data):
+        gateway.write_bytes(checkpoint_name(year, week), weekly_data.to_csv(index=False))
+
+    fetch_start = time.perf_counter()
+    season_data = get_season_data(
+        year, our_league, existing=existing, max_workers=max_workers, on_week=checkpoint
+    )
+    timings["fetch_seconds"] = time.perf_counter() - fetch_start
+    logging.info(f"{year}: Data downloaded")
 
-        # Download the waiver data
-        ra = our_league.recent_activity(2000)
-        fs = gcsfs.GCSFileSystem(project=PROJECT_NAME)
+    # Save the data
+    save_start = time.perf_counter()
+    complete_week = last_completed_week(season_data, our_league)
+    timings["weeks"] = complete_week
+    gateway.write_bytes(season_name, season_data.to_csv(index=False), "text/csv")
+    write_season_data(season_data, gateway.path("season_data"), filesystem=gateway.filesystem)
+    logging.info(f"{year}: Data saved to GCS")
 
-        logging.info("Waiver data downloaded")
+    # Append the waiver data since the last run
+    transaction_store = gateway.path(f"wd_{year}")
+    new_transactions = sync_transactions(
+        our_league, transaction_store, filesystem=gateway.filesystem
+    )
+    logging.info(f"{year}: Waiver data saved, {new_transactions} new transactions")
+    timings["save_seconds"] = time.perf_counter() - save_start
 
-        filename = f"{BUCKET_NAME}/wd_{year}.pickle"
-        with fs.open(filename, "wb") as handle:
-            pickle.dump(ra, handle, protocol=pickle.HIGHEST_PROTOCOL)
-        logging.info("Waiver data saved")
+    # Precompute the dashboard tables so page views only read them
+    # There is nothing to precompute until every team has finished a week
+    analytics_start = time.perf_counter()
+    if not has_complete_weeks(season_data):
+        logging.info(f"{year}: No complete weeks yet, analytics skipped")
+    else:
+        transactions = transactions_frame([])
+        if gateway.list_blobs(f"wd_{year}/"):
+            transactions = read_transactions(transaction_store, filesystem=gateway.filesystem)
+        analytics = build_analytics(season_data, our_league, transactions, seed=year)
+        write_analytics(analytics, gateway, year, complete_week)
+        logging.info(f"{year}: Analytics saved through week {complete_week}")
+    timings["analytics_seconds"] = time.perf_counter() - analytics_start
 
+    # The season is saved, the checkpoints are no longer needed
+    for blob in gateway.list_blobs(f"checkpoints/{year}/"):
+        gateway.delete(blob.name)
+    timings["total_seconds"] = time.perf_counter() - start
+    return timings
+
+
+def parse_years(years):
+    """Years from "2019-2024", "2019,2021" or a mix of both"""
+    parsed = []
+    for part in str(years).split(","):
+        first, _, last = part.partition("-")
+        parsed.extend(range(int(first), int(last or first) + 1))
+    return parsed
+
+
+def timing_summary(timings):
+    """One line per year with the seconds spent fetching, saving and building analytics"""
+    summary = pd.DataFrame(timings).set_index("year").sort_index()
+    return summary.round(2).to_string()
+
+
+def backfill(years, full_refetch=False, year_workers=3, week_workers=1):
+    """Save several seasons, up to year_workers at a time, and print how long each took"""
+    gateway = get_gateway(BUCKET_NAME)
+    with ThreadPoolExecutor(max_workers=year_workers) as executor:
+        timings = list(
+            executor.map(lambda year: save_year(gateway, year, full_refetch, week_workers), years)
+        )
+    summary = timing_summary(timings)
+    print(summary)
+    logging.info(f"Backfill finished\n{summary}")
+    if tracing.enabled():
+        tracing.log_summary()
+    return timings
+
+
+def save_season_data(request):
+    """Save the current season on GCP, or a range of seasons with ?years=2019-2024
+
+    ?full=1 refetches every week instead of starting after the stored watermark,
+    ?workers=N sets how many seasons are downloaded at once and ?trace=1 (or =memory) logs
+    the time spent in every ESPN call, storage transfer and table build as JSON.
+    """
+    args = request.args if request is not None else {}
+    trace = args.get("trace")
+    # Trace only this request, a warm instance keeps the module state for later requests
+    if trace:
+        tracing.enable(memory=trace == "memory")
+        tracing.reset()
+    try:
+        years = parse_years(args.get("years", CURRENT_SEASON))
+        backfill(
+            years,
+            full_refetch=bool(args.get("full")),
+            year_workers=int(args.get("workers", 3)),
+        )
+    finally:
+        if trace:
+            tracing.disable()
     return "Finished"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill seasons into the bucket")
+    parser.add_argument("--years", default=str(CURRENT_SEASON), help="e.g. 2019-2024")
+    parser.add_argument("--full", action="store_true", help="Refetch every week")
+    parser.add_argument("--workers", type=int, default=3, help="Seasons fetched at once")
+    parser.add_argument("--week-workers", type=int, default=1, help="Weeks fetched at once")
+    parser.add_argument("--trace", choices=["time", "memory"], help="Log timings as JSON")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.trace:
+        tracing.enable(memory=args.trace == "memory")
+    backfill(parse_years(args.years), args.full, args.workers, args.week_workers)
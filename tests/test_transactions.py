@@ -0,0 +1,63 @@
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+from espn_data.transactions import activity_rows, read_transactions, sync_transactions
+
+
+def activity(date, owner, action, player_id):
+    team = SimpleNamespace(owner=owner)
+    player = SimpleNamespace(playerId=player_id, name=f"Player {player_id}")
+    return SimpleNamespace(date=date, actions=[(team, action, player, 0)])
+
+
+class FakeActivityLeague:
+    """recent_activity over a fixed list of activities, newest first"""
+
+    def __init__(self, activities):
+        self.activities = activities
+
+    def recent_activity(self, size=25, offset=0):
+        return self.activities[offset : offset + size]
+
+
+class SyncTransactionsTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = f"{directory.name}/wd_2019"
+
+    def test_resumes_a_batch_that_shares_the_watermark_timestamp(self):
+        earlier = activity(1000, "Jon Samos", "WAIVER ADDED", 1)
+        batch = [
+            activity(2000, "Kyle Samos", "WAIVER ADDED", 2),
+            activity(2000, "Tyler Simons", "WAIVER ADDED", 3),
+        ]
+
+        # The first sync only saw part of the waiver run at 2000
+        self.assertEqual(sync_transactions(FakeActivityLeague([batch[0], earlier]), self.store), 2)
+
+        newer = activity(3000, "Jon Samos", "FA ADDED", 4)
+        league = FakeActivityLeague([newer, batch[1], batch[0], earlier])
+        self.assertEqual(sync_transactions(league, self.store, page_size=2), 2)
+
+        stored = read_transactions(self.store).sort_values(["date", "player_id"])
+        full = sorted(row[:4] for row in activity_rows(league.activities))
+        self.assertEqual(
+            list(
+                stored[["date", "team_name", "action", "player_id"]]
+                .astype(object)
+                .itertuples(index=False, name=None)
+            ),
+            full,
+        )
+
+    def test_nothing_new_writes_nothing(self):
+        league = FakeActivityLeague([activity(2000, "Kyle Samos", "WAIVER ADDED", 2)])
+        sync_transactions(league, self.store)
+        self.assertEqual(sync_transactions(league, self.store), 0)
+        self.assertEqual(len(read_transactions(self.store)), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()